@@ -0,0 +1,141 @@
+"""Versioned JSON API for kiosk and mobile clients.
+
+Every GET carries an ETag built from the change generations of the tables it
+reads, so a client polling with If-None-Match gets a 304 straight from the
+shared counters without touching SQLite.
+"""
+import hashlib
+import json
+from datetime import date
+
+from flask import Blueprint, Response, abort, jsonify, request, session, stream_with_context
+
+from database import BOOK_COLUMNS, generations, get_read_db, search_books
+from migrations import LATEST_VERSION
+from repository import user_loans
+from suggest import SUGGEST_LIMIT, suggest_index
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+def make_etag(*parts):
+    """ETag for parts plus the schema version and generation file instance.
+
+    The generation counters restart at 0 when their file is recreated, and
+    migrations do not bump them, so on their own an old ETag could match new
+    data after a reset or an upgrade. check_schema() refuses to serve a library
+    whose user_version is not LATEST_VERSION, so that constant is the schema
+    version of every response.
+    """
+    return hashlib.sha1(repr((LATEST_VERSION, generations.instance) + parts).encode()).hexdigest()
+
+def not_modified(etag):
+    """A 304 response if the client already has this version, else None"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+@api.before_request
+def require_login():
+    if 'user_id' not in session:
+        return jsonify(error='login required'), 401
+
+@api.errorhandler(404)
+def not_found(error):
+    return jsonify(error='not found'), 404
+
+@api.route('/books')
+def list_books():
+    """Stream the whole catalogue (or ?available=1) as a JSON array"""
+    available_only = request.args.get('available') == '1'
+    etag = make_etag('books', available_only, generations.get('books'))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    sql = f"SELECT {', '.join(BOOK_COLUMNS)} FROM books"
+    if available_only:
+        sql += ' WHERE available = 1'
+    rows = get_read_db().execute(sql + ' ORDER BY title, id')
+
+    def generate():
+        yield '['
+        for index, row in enumerate(rows):
+            yield (',' if index else '') + json.dumps(dict(zip(BOOK_COLUMNS, row)), ensure_ascii=False)
+        yield ']'
+
+    return with_etag(Response(stream_with_context(generate()), mimetype='application/json'), etag)
+
+@api.route('/books/<int:book_id>')
+def get_book(book_id):
+    """One book with its availability"""
+    etag = make_etag('book', book_id, generations.get('books'))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    row = get_read_db().execute(
+        f"SELECT {', '.join(BOOK_COLUMNS)} FROM books WHERE id = ?", (book_id,)
+    ).fetchone()
+    if row is None:
+        abort(404)
+    return with_etag(jsonify(dict(zip(BOOK_COLUMNS, row))), etag)
+
+@api.route('/users/<int:user_id>/loans')
+def get_loans(user_id):
+    """A user's open and returned loans with fines; students and employees see only their own.
+
+    ?history=all adds loans that have been moved to the archive.
+    """
+    if session.get('user_type') != 'admin' and session['user_id'] != user_id:
+        return jsonify(error='forbidden'), 403
+    # Fines grow daily, so the date is part of the version
+    full_history = request.args.get('history') == 'all'
+    etag = make_etag('loans', user_id, full_history, generations.snapshot('books', 'transactions'),
+                     date.today().isoformat())
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    issued, returned = [], []
+    for loan in user_loans(get_read_db(), user_id, full_history):
+        (issued if loan['status'] == 'issued' else returned).append(dict(loan))
+    return with_etag(jsonify(
+        user_id=user_id,
+        issued=issued,
+        returned=returned,
+        total_fine=sum(loan['fine'] for loan in issued),
+    ), etag)
+
+@api.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    etag = make_etag('search', query, limit, generations.get('books'))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    books = search_books(get_read_db(), query, limit) if query else []
+    return with_etag(jsonify(query=query, results=[
+        {column: book[column] for column in BOOK_COLUMNS} for book in books
+    ]), etag)
+
+@api.route('/suggest')
+def suggest():
+    """Typeahead: up to ?limit= books whose title, author or code words start with what was typed in ?q="""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', SUGGEST_LIMIT, type=int), 50))
+    etag = make_etag('suggest', query, limit, generations.get('books'))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return with_etag(jsonify(query=query, results=suggest_index.suggest(get_read_db(), query, limit)), etag)
@@ -0,0 +1,76 @@
+"""Move old returned loans out of the hot transactions table, and keep the file tidy.
+
+Dashboards, the admin pages and every circulation write work on
+transactions; returned loans only ever accumulate there. Loans returned more
+than ARCHIVE_AFTER_DAYS ago move to transactions_archive in the same
+database, so the move is one atomic transaction per batch (an attached file
+would not be atomic across both files under WAL). History that reaches into
+the archive is read only when asked for (repository.user_loans).
+"""
+import os
+from datetime import date, timedelta
+
+from database import generations
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_BATCH = 5000
+
+def archive_cutoff(older_than_days=ARCHIVE_AFTER_DAYS):
+    """Loans returned before this date ('YYYY-MM-DD') are archived"""
+    return (date.today() - timedelta(days=older_than_days)).isoformat()
+
+# One batch: copy up to ? loans returned before the cutoff into the archive, returning their ids
+MOVE_BATCH = '''
+    INSERT INTO transactions_archive (id, user_id, book_id, copy_id, issue_date, return_date)
+    SELECT id, user_id, book_id, copy_id, issue_date, return_date FROM transactions
+    WHERE status = 'returned' AND return_date < ?
+    ORDER BY return_date, id LIMIT ?
+    RETURNING id
+'''
+
+def archive_returned_loans(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH):
+    """Move returned loans older than the cutoff to transactions_archive; returns how many moved.
+
+    Each batch is its own short BEGIN IMMEDIATE transaction, so issue and
+    return desks wait for one batch at most, never the whole run.
+    """
+    cutoff = archive_cutoff(older_than_days)
+    moved = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = [row[0] for row in conn.execute(MOVE_BATCH, (cutoff, batch_size))]
+            if ids:
+                conn.execute(f"DELETE FROM transactions WHERE id IN ({', '.join('?' * len(ids))})", ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved += len(ids)
+        if len(ids) < batch_size:
+            break
+    if moved:
+        generations.bump('transactions')
+    return moved
+
+def database_size(conn):
+    """(bytes in the file, bytes on the free list)"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return pages * page_size, free * page_size
+
+def maintain_database(conn, vacuum=False):
+    """Refresh planner statistics, optionally VACUUM, and checkpoint the WAL.
+
+    VACUUM rewrites the whole file and blocks writers while it runs, so it is
+    opt-in; after a large archive run it returns the freed pages to the disk.
+    Returns database_size() before and after.
+    """
+    before = database_size(conn)
+    conn.execute('ANALYZE')
+    conn.commit()
+    if vacuum:
+        conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return before, database_size(conn)
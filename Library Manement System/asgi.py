@@ -0,0 +1,21 @@
+"""ASGI entry point: serve the Flask app from an event loop with a bounded executor.
+
+    uvicorn asgi:application --workers 4 --host 0.0.0.0 --port 5000
+
+The event loop holds idle keep-alive and slow connections without tying up a
+thread. Each request's view, SQLite work and template rendering run on a
+fixed-size thread pool that is no larger than the connection pool, so a burst
+of dashboard loads queues in the loop instead of exhausting workers or
+blocking in read_pool.acquire(). Every existing route works unchanged.
+"""
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from database import read_pool
+from main import app
+
+# One executor thread per pooled connection by default; more would only wait on the pool
+EXECUTOR_THREADS = int(os.environ.get('ASGI_THREADS', read_pool.max_connections))
+
+application = WSGIMiddleware(app, workers=EXECUTOR_THREADS)
@@ -1,58 +1,163 @@
-def authenticate_user(user_type, credentials):
-    """Authenticate user based on type and credentials"""
-    from database import get_db_connection
-    
-    conn = get_db_connection()
-    user = None
-    
-    try:
-        if user_type == 'student':
-            user = conn.execute('''
-                SELECT * FROM users 
-                WHERE user_type = 'student' 
-                AND admission_number = ? 
-                AND password = ?
-            ''', (
-                credentials['admission_number'],
-                credentials['password']
-            )).fetchone()
-            
-        elif user_type == 'employee':
-            user = conn.execute('''
-                SELECT * FROM users 
-                WHERE user_type = 'employee' 
-                AND name = ? 
-                AND department = ? 
-                AND password = ?
-            ''', (
-                credentials['name'],
-                credentials['department'],
-                credentials['password']
-            )).fetchone()
-            
-        elif user_type == 'admin':
-            user = conn.execute('''
-                SELECT * FROM users 
-                WHERE user_type = 'admin' 
-                AND phone = ? 
-                AND password = ?
-            ''', (
-                credentials['phone'],
-                credentials['password']
-            )).fetchone()
-        
-        return dict(user) if user else None
-        
-    finally:
-        conn.close()
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import LRUCache
+
+# werkzeug method string: raise the scrypt N (or pbkdf2 iterations) as hardware
+# allows. Stored hashes made with any other setting are upgraded on next login.
+PASSWORD_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+
+# Recent verifications keyed by (user id, session nonce, HMAC of password and
+# stored hash); a re-login from the same session skips the KDF
+verification_cache = LRUCache(
+    maxsize=int(os.environ.get('AUTH_CACHE_SIZE', 1024)),
+    ttl=int(os.environ.get('AUTH_CACHE_TTL', 900)),
+)
+# user id -> role and display name, dropped whenever the users generation moves
+user_profiles = LRUCache(maxsize=int(os.environ.get('USER_CACHE_SIZE', 4096)), ttl=3600)
+_cache_key = secrets.token_bytes(32)
+_dummy_hash = None
+
+# Only what a login needs: the session takes id and name/admission number
+LOGIN_COLUMNS = 'id, user_type, name, admission_number, password'
+
+LOGIN_QUERIES = {
+    'student': (f'''
+        SELECT {LOGIN_COLUMNS} FROM users
+        WHERE user_type = 'student'
+        AND admission_number = ?
+    ''', ('admission_number',)),
+    'employee': (f'''
+        SELECT {LOGIN_COLUMNS} FROM users
+        WHERE user_type = 'employee'
+        AND name = ?
+        AND department = ?
+    ''', ('name', 'department')),
+    'admin': (f'''
+        SELECT {LOGIN_COLUMNS} FROM users
+        WHERE user_type = 'admin'
+        AND phone = ?
+    ''', ('phone',)),
+}
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_METHOD)
+
+def hash_passwords(passwords):
+    """Hash many passwords on a thread per core; the KDF releases the GIL"""
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        return list(executor.map(hash_password, passwords))
+
+def is_hashed(stored):
+    return bool(stored) and stored.startswith(HASH_PREFIXES) and stored.count('$') == 2
+
+def dummy_hash():
+    """A hash of a random password made with PASSWORD_METHOD, computed once"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    return _dummy_hash
+
+def needs_rehash(stored):
+    """Whether a stored hash was made with other settings than PASSWORD_METHOD.
+
+    Compared with the method werkzeug actually writes, which fills in the
+    defaults of a short form ('scrypt' is stored as 'scrypt:32768:8:1').
+    """
+    return stored.split('$', 1)[0] != dummy_hash().split('$', 1)[0]
+
+def verify_password(stored, password):
+    """Check a password against a stored hash, or a legacy plaintext value"""
+    if not stored or not password:
+        return False
+    if is_hashed(stored):
+        return check_password_hash(stored, password)
+    return hmac.compare_digest(stored.encode(), password.encode())
+
+def cached_verify(user_id, nonce, stored, password):
+    if not nonce:
+        return verify_password(stored, password)
+    digest = hmac.new(_cache_key, f'{stored}\0{password}'.encode(), hashlib.sha256).digest()
+    return verification_cache.get((user_id, nonce, digest), lambda: verify_password(stored, password))
+
+def burn_verification(password):
+    """Spend one KDF run so unknown users take as long as wrong passwords"""
+    check_password_hash(dummy_hash(), password or '')
+
+def authenticate_user(user_type, credentials, nonce=None):
+    """Authenticate user based on type and credentials.
+
+    Users are looked up by identifier only and the password is checked with
+    the KDF. Legacy plaintext and outdated hashes are rehashed on success.
+    `nonce` is the session's login nonce, if it has one.
+    """
+    from database import get_read_db, write
+
+    if user_type not in LOGIN_QUERIES:
+        return None
+    sql, fields = LOGIN_QUERIES[user_type]
+    conn = get_read_db()
+    password = credentials.get('password')
+    candidates = conn.execute(sql, tuple(credentials.get(field) for field in fields)).fetchall()
+    if not candidates:
+        burn_verification(password)
+        return None
+
+    for user in candidates:
+        stored = user['password']
+        if cached_verify(user['id'], nonce, stored, password):
+            if needs_rehash(stored):
+                write(store_rehash, user['id'], stored, hash_password(password))
+            return dict(user)
+    return None
+
+def store_rehash(conn, user_id, stored, hashed):
+    """Replace a user's password hash, unless it changed since it was verified"""
+    with conn:
+        conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?', (hashed, user_id, stored))
+
+def rehash_plaintext_passwords(conn, batch_size=500):
+    """Hash every legacy plaintext password in place; returns how many were upgraded"""
+    upgraded = 0
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, password FROM users
+            WHERE id > ? AND password IS NOT NULL
+            ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return upgraded
+        last_id = rows[-1]['id']
+        plaintext = [row for row in rows if not is_hashed(row['password'])]
+        hashes = hash_passwords([row['password'] for row in plaintext])
+        with conn:
+            conn.executemany('UPDATE users SET password = ? WHERE id = ? AND password = ?', [
+                (hashed, row['id'], row['password']) for row, hashed in zip(plaintext, hashes)
+            ])
+        upgraded += len(plaintext)
+
+def get_user_profile(user_id):
+    """Get a user's role and display name, cached until users change"""
+    from database import generations, get_read_db
+
+    def load():
+        user = get_read_db().execute(
+            'SELECT user_type, name, admission_number FROM users WHERE id = ?', (user_id,)
+        ).fetchone()
+        if user is None:
+            return None
+        return {'user_type': user['user_type'], 'name': user['name'] or user['admission_number'] or ''}
+
+    return user_profiles.get((user_id, generations.get('users')), load)
 
 def get_user_role(user_id):
     """Get user role by user ID"""
-    from database import get_db_connection
-    
-    conn = get_db_connection()
-    try:
-        user = conn.execute('SELECT user_type FROM users WHERE id = ?', (user_id,)).fetchone()
-        return user['user_type'] if user else None
-    finally:
-        conn.close()
+    profile = get_user_profile(user_id)
+    return profile['user_type'] if profile else None
@@ -0,0 +1,134 @@
+"""Helpers shared by the benchmark scripts: HTTP clients, server processes and percentiles"""
+import http.client
+import socket
+import subprocess
+import threading
+import time
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def summarize(latencies, errors, elapsed):
+    """Throughput and latency percentiles (in seconds) for one run"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else 0.0,
+    }
+
+def run_closed_loop(setup, step, clients, duration):
+    """Run `clients` threads for `duration` seconds, each calling step(setup(n)) back to back.
+
+    step() returns True for a successful request; failures and exceptions count
+    as errors and are left out of the latency figures.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    ready = threading.Barrier(clients + 1)
+    stop = threading.Event()
+
+    def user(number):
+        try:
+            state = setup(number)
+        finally:
+            ready.wait()
+        mine, failed = [], 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                ok = step(state)
+            except Exception:
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=user, args=(n,), daemon=True) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, sum(errors), time.perf_counter() - started)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server did not start listening on port {port}')
+
+class ServerProcess:
+    """Run a server command until the block exits"""
+
+    def __init__(self, command, env):
+        self.command = command
+        self.env = env
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+class HTTPClient:
+    """One simulated user: a session cookie and a reusable HTTP connection"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+        self.cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request; returns (status, body bytes)"""
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body, headers)
+                response = self.conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # A keep-alive connection the server already closed; retry once fresh
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+                continue
+            if response.will_close:
+                self.conn.close()
+                self.conn = None
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            return response.status, data
@@ -0,0 +1,153 @@
+"""Measure dashboard latency while desks issue and return books as fast as they can.
+
+    python -m benchmarks.contention [DATABASE] [--readers 8] [--writers 4] [--duration 10]
+
+Without DATABASE a seeded temporary library is used; a datagen library
+(python -m benchmarks.datagen) gives realistic dashboards. Each mode runs on a
+fresh copy of it. Reader threads load student, employee and (one in ten) admin
+dashboards back to back; writer threads issue a book and return it again in a
+loop. Modes:
+
+  quiet     split layout with no writers, the latency to compare against
+  rollback  rollback journal, readers and writers on one pool: what WAL avoids
+  shared    WAL, readers and writers on one read-write pool, writers racing
+            for the write lock through busy_timeout
+  split     WAL, dashboards on the query-only read pool, writes queued to
+            the single Writer connection (what the app does)
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile, run_closed_loop
+
+MODES = ('quiet', 'rollback', 'shared', 'split')
+
+def copy_database(source, target):
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+def layout(mode, path, readers, writers):
+    """(read pool, write(fn, *args)) for a mode"""
+    from database import PRAGMAS, READ_ONLY_PRAGMAS, ConnectionPool, Writer
+
+    if mode in ('quiet', 'split'):
+        writer = Writer(ConnectionPool(path, 1))
+        return ConnectionPool(path, readers, READ_ONLY_PRAGMAS), writer.run
+    pragmas = PRAGMAS if mode == 'shared' else (('journal_mode', 'DELETE'),) + PRAGMAS[1:]
+    shared = ConnectionPool(path, readers + writers, pragmas)
+
+    def write(fn, *args):
+        conn = shared.acquire()
+        try:
+            return fn(conn, *args)
+        finally:
+            shared.release(conn)
+    return shared, write
+
+def run_mode(mode, path, args):
+    from circulation import issue_book, return_loan
+    from repository import admin_dashboard, user_dashboard
+
+    writers = 0 if mode == 'quiet' else args.writers
+    read_pool, write = layout(mode, path, args.readers, writers)
+    conn = read_pool.acquire()
+    users = conn.execute("SELECT id FROM users WHERE user_type IN ('student', 'employee') LIMIT 1000").fetchall()
+    books = [row[0] for row in conn.execute('SELECT id FROM books WHERE copies_available > 0 LIMIT 10000')]
+    read_pool.release(conn)
+    user_ids = [row[0] for row in users]
+
+    stop = threading.Event()
+    write_latencies = []
+    write_errors = []
+    lock = threading.Lock()
+
+    def desk(number):
+        rng = random.Random(number)
+        # Each desk works its own slice of the shelf, so every issue finds a copy
+        shelf = books[number::writers]
+        mine, failed = [], 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                transaction_id = write(issue_book, rng.choice(shelf), rng.choice(user_ids))
+                if transaction_id is None or not write(return_loan, transaction_id):
+                    failed += 1
+                    continue
+            except sqlite3.OperationalError:
+                failed += 1
+                continue
+            mine.append(time.perf_counter() - started)
+        with lock:
+            write_latencies.extend(mine)
+            write_errors.append(failed)
+
+    def reader(number):
+        return random.Random(1000 + number)
+
+    def load_dashboard(rng):
+        conn = read_pool.acquire()
+        try:
+            if rng.random() < 0.1:
+                admin_dashboard(conn)
+            else:
+                user_dashboard(conn, rng.choice(user_ids))
+            return True
+        finally:
+            read_pool.release(conn)
+
+    desks = [threading.Thread(target=desk, args=(n,), daemon=True) for n in range(writers)]
+    for thread in desks:
+        thread.start()
+    started = time.perf_counter()
+    reads = run_closed_loop(reader, load_dashboard, args.readers, args.duration)
+    stop.set()
+    for thread in desks:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return reads, len(write_latencies) / elapsed, sum(write_errors), sorted(write_latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', nargs='?')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--mode', dest='modes', action='append', choices=MODES, help='Run only these modes.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    source = args.database or os.path.join(directory, 'source.db')
+    os.environ['LIBRARY_DB'] = os.path.join(directory, 'contention.db')
+    from database import ConnectionPool, seed_db
+    from migrations import migrate
+
+    if not args.database:
+        seeding = ConnectionPool(source, 1)
+        conn = seeding.acquire()
+        migrate(conn)
+        seed_db(conn)
+        seeding.release(conn)
+        seeding.close_all()
+
+    print(f'{args.readers} dashboard readers, {args.writers} issue/return desks, {args.duration:g} s per mode')
+    print(f"{'mode':<9} {'reads/s':>8} {'p50 ms':>8} {'p95':>8} {'p99':>8} {'max':>8} {'errors':>7}"
+          f" {'loans/s':>8} {'loan p95':>9} {'failed':>7}")
+    for mode in args.modes or MODES:
+        path = os.path.join(directory, f'{mode}.db')
+        copy_database(source, path)
+        reads, loans, failed, write_latencies = run_mode(mode, path, args)
+        print(f"{mode:<9} {reads['rps']:>8.0f} {reads['p50'] * 1000:>8.2f} {reads['p95'] * 1000:>8.2f} "
+              f"{reads['p99'] * 1000:>8.2f} {reads['max'] * 1000:>8.1f} {reads['errors']:>7} "
+              f"{loans:>8.0f} {percentile(write_latencies, 0.95) * 1000:>9.2f} {failed:>7}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""Generate a large synthetic library for benchmarking, reproducibly from a seed.
+
+    python -m benchmarks.datagen OUTPUT.db [--size small|medium|large] [--books N] [--users N]
+                                           [--transactions N] [--copies N] [--seed 42] [--force]
+
+Sizes: small is 10k books, 2k users and 100k loans; medium is 100k/20k/1M;
+large is 1M/50k/5M. The demo users and books from seed_db are always present,
+so the usual demo logins work. Every generated user's password is "password".
+Each title gets between 1 and --copies copies (default 1). A fraction of
+copies (--open-fraction) are on loan, some of them overdue; the rest of the
+history is returned loans spread over two years.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+SIZES = {
+    'small': (10_000, 2_000, 100_000),
+    'medium': (100_000, 20_000, 1_000_000),
+    'large': (1_000_000, 50_000, 5_000_000),
+}
+CHUNK = 50_000
+
+ADJECTIVES = ('Silent', 'Hidden', 'Golden', 'Broken', 'Forgotten', 'Crimson', 'Distant', 'Endless',
+              'Frozen', 'Gentle', 'Hollow', 'Iron', 'Lonely', 'Midnight', 'Northern', 'Painted',
+              'Quiet', 'Restless', 'Scarlet', 'Secret', 'Shattered', 'Stolen', 'Wandering', 'Wild')
+NOUNS = ('Garden', 'River', 'Kingdom', 'Mirror', 'Journey', 'Empire', 'Harbor', 'Forest', 'Orchard',
+         'Lantern', 'Mountain', 'Ocean', 'Library', 'Castle', 'Island', 'Valley', 'Tower', 'Compass',
+         'Storm', 'Voyage', 'Letters', 'Shadows', 'Stars', 'Winter')
+TOPICS = ('of Time', 'of the North', 'at Dawn', 'of Glass', 'in Exile', 'of Memory', 'and Ash',
+          'of the Deep', 'Beyond', 'Returns', 'Chronicles', 'of Kashmir', 'of the Sea', '')
+CATEGORIES = ('Fiction', 'Fantasy', 'Science Fiction', 'Romance', 'Drama', 'Adventure', 'History',
+              'Biography', 'Poetry', 'Mathematics', 'Physics', 'Chemistry', 'Biology', 'Geography',
+              'Philosophy', 'Horror', 'Mystery', 'Computer Science', 'Economics', 'Urdu Literature')
+FIRST_NAMES = ('Aamir', 'Ayesha', 'Bilal', 'Danish', 'Fatima', 'Hamid', 'Iqra', 'Javid', 'Khalid',
+               'Mehreen', 'Nadia', 'Omar', 'Rashid', 'Saba', 'Tariq', 'Uzma', 'Yasir', 'Zainab')
+LAST_NAMES = ('Ahmad', 'Bhat', 'Dar', 'Ganie', 'Hussain', 'Khan', 'Lone', 'Malik', 'Mir', 'Naikoo',
+              'Qureshi', 'Rather', 'Shah', 'Sheikh', 'Wani')
+DEPARTMENTS = ('ICT', 'Science', 'Mathematics', 'Languages', 'Humanities', 'Sports', 'Administration')
+CLASSES = ('6th', '7th', '8th', '9th', '10th', '11th', '12th')
+SECTIONS = ('Green', 'Blue', 'Red', 'Yellow')
+
+def person(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+def generate_books(rng, first_id, count):
+    for book_id in range(first_id, first_id + count):
+        title = f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(TOPICS)}'.strip()
+        yield (book_id, title, rng.choice(CATEGORIES), person(rng), f'GEN{book_id:07d}')
+
+def generate_users(rng, count, password_hash):
+    for number in range(1, count + 1):
+        if rng.random() < 0.9:
+            yield ('student', person(rng), f'S{number:06d}', rng.choice(CLASSES), rng.choice(SECTIONS),
+                   str(rng.randint(1, 60)), None, None, None, password_hash)
+        else:
+            yield ('employee', f'{person(rng)} {number}', None, None, None, None,
+                   rng.choice(DEPARTMENTS), rng.choice(CATEGORIES), None, password_hash)
+
+def generate_copies(rng, books, max_copies, barcode):
+    for book_id, code in books:
+        for number in range(1, rng.randint(1, max_copies) + 1):
+            yield (book_id, barcode(code, number))
+
+def generate_returned(rng, count, copies, user_ids, today):
+    for _ in range(count):
+        copy_id, book_id = rng.choice(copies)
+        issued = today - timedelta(days=rng.randint(2, 730))
+        returned = min(today - timedelta(days=1), issued + timedelta(days=rng.randint(1, 30)))
+        yield (rng.choice(user_ids), book_id, copy_id, issued.isoformat(), returned.isoformat(), 'returned')
+
+def insert_chunks(conn, sql, rows):
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == CHUNK:
+            with conn:
+                conn.executemany(sql, batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        with conn:
+            conn.executemany(sql, batch)
+        total += len(batch)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--books', type=int)
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--transactions', type=int, help='Total loans, open and returned.')
+    parser.add_argument('--copies', type=int, default=1, help='Most copies of one title (each gets 1 to N).')
+    parser.add_argument('--open-fraction', type=float, default=0.05, help='Share of copies currently on loan.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help='Replace OUTPUT if it exists.')
+    args = parser.parse_args()
+
+    books, users, transactions = SIZES[args.size]
+    books = args.books if args.books is not None else books
+    users = args.users if args.users is not None else users
+    transactions = args.transactions if args.transactions is not None else transactions
+
+    if os.path.exists(args.output):
+        if not args.force:
+            sys.exit(f'{args.output} exists; pass --force to replace it')
+        for suffix in ('', '-wal', '-shm', '-generations', '-sessions'):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+
+    # database.py reads LIBRARY_DB at import, so the generations file matches OUTPUT
+    os.environ['LIBRARY_DB'] = args.output
+    from auth import hash_password
+    from database import copy_barcode, generations, seed_db
+    from migrations import migrate
+
+    rng = random.Random(args.seed)
+    today = date.today()
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.output)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    migrate(conn)
+    seed_db(conn)
+
+    first_book = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM books').fetchone()[0]
+    insert_chunks(conn, '''
+        INSERT INTO books (id, title, category, author, code)
+        VALUES (?, ?, ?, ?, ?)
+    ''', generate_books(rng, first_book, books))
+    # Triggers on book_copies keep the copy counters on books
+    new_books = conn.execute('SELECT id, code FROM books WHERE id >= ? ORDER BY id', (first_book,)).fetchall()
+    copies = insert_chunks(conn, 'INSERT INTO book_copies (book_id, barcode) VALUES (?, ?)',
+                           generate_copies(rng, new_books, max(1, args.copies), copy_barcode))
+    print(f'{books:,} books, {copies:,} copies ({time.perf_counter() - started:.1f}s)')
+
+    # One shared hash: hashing tens of thousands of passwords would dominate the run
+    insert_chunks(conn, '''
+        INSERT INTO users (user_type, name, admission_number, class_name, section,
+                           roll_number, department, subject, phone, password)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', generate_users(rng, users, hash_password('password')))
+    print(f'{users:,} users ({time.perf_counter() - started:.1f}s)')
+
+    shelf = [tuple(row) for row in conn.execute("SELECT id, book_id FROM book_copies WHERE status = 'available'")]
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE user_type != 'admin'")]
+    open_copies = rng.sample(shelf, min(len(shelf), int(copies * args.open_fraction), transactions))
+    open_loans = [
+        (rng.choice(user_ids), book_id, copy_id, (today - timedelta(days=rng.randint(0, 30))).isoformat(),
+         None, 'issued')
+        for copy_id, book_id in open_copies
+    ]
+    insert_sql = '''
+        INSERT INTO transactions (user_id, book_id, copy_id, issue_date, return_date, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    insert_chunks(conn, insert_sql, open_loans)
+    insert_chunks(conn, "UPDATE book_copies SET status = 'on_loan' WHERE id = ?",
+                  ((copy_id,) for copy_id, _ in open_copies))
+    returned = insert_chunks(conn, insert_sql,
+                             generate_returned(rng, transactions - len(open_loans), shelf, user_ids, today))
+    print(f'{len(open_loans):,} open and {returned:,} returned loans ({time.perf_counter() - started:.1f}s)')
+
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    generations.bump('books', 'transactions', 'users')
+    print(f'Wrote {args.output} in {time.perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Measure logins/sec at each password hashing cost, with and without the verification cache.
+
+    python -m benchmarks.login_throughput [--methods scrypt:16384:8:1 ...] [--logins 100] [--threads N]
+
+"cold" logins run the KDF every time (a new session each); "cached" logins
+repeat from a session that already has a login nonce.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_METHODS = ['pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1', 'scrypt:65536:8:1']
+STUDENT = {'admission_number': '7354', 'password': 'student123'}
+
+def logins_per_second(app, auth, logins, threads, nonce):
+    def login(_):
+        with app.app_context():
+            if not auth.authenticate_user('student', STUDENT, nonce):
+                raise RuntimeError('login failed')
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(login, range(threads)))  # warm the pool and the cache
+        started = time.perf_counter()
+        list(executor.map(login, range(logins)))
+        return logins / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--methods', nargs='+', default=DEFAULT_METHODS, help='werkzeug hash method strings.')
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['LIBRARY_DB'] = os.path.join(directory, 'logins.db')
+        import auth
+        from database import get_db
+        from main import app, init_db
+
+        print(f'{args.threads} thread(s), {args.logins} logins per setting')
+        print(f"{'method':<24} {'hash ms':>8} {'cold/s':>8} {'cached/s':>9}")
+        with app.app_context():
+            init_db()
+        for method in args.methods:
+            auth.PASSWORD_METHOD = method
+            auth.verification_cache.clear()
+            started = time.perf_counter()
+            hashed = auth.hash_password(STUDENT['password'])
+            hash_ms = (time.perf_counter() - started) * 1000
+            with app.app_context():
+                conn = get_db()
+                conn.execute("UPDATE users SET password = ? WHERE admission_number = ?",
+                             (hashed, STUDENT['admission_number']))
+                conn.commit()
+            cold = logins_per_second(app, auth, args.logins, args.threads, None)
+            cached = logins_per_second(app, auth, args.logins, args.threads, 'benchmark-session')
+            print(f'{method:<24} {hash_ms:>8.1f} {cold:>8.1f} {cached:>9.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Measure dashboard render time with the shared fragments rendered inline vs cached.
+
+    python -m benchmarks.render_time [DATABASE] [--iterations 200]
+
+Without DATABASE a seeded temporary library is used. "inline" clears the
+fragment cache before every render, which is what each request paid before
+fragments were cached; "cached" is the steady state. Data loading is done once
+up front, so only template work is timed. Also reports how long compiling
+every template takes, which precompile_templates moves from the first
+requests of each worker to startup.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.common import percentile
+
+ROLES = {
+    'student': ('dashboard_student.html', '7354'),
+    'employee': ('dashboard_employee.html', None),
+    'admin': ('dashboard_admin.html', None),
+}
+
+def measure(render, iterations, before=None):
+    timings = []
+    for _ in range(iterations):
+        if before:
+            before()
+        started = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return sum(timings) / len(timings), percentile(timings, 0.95)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', nargs='?')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ['LIBRARY_DB'] = args.database or os.path.join(tempfile.mkdtemp(), 'render.db')
+    from flask import render_template, session
+    from database import get_db, init_db
+    from fragments import fragment_cache, precompile_templates, with_fragments
+    from main import app
+    from repository import dashboard
+
+    with app.app_context():
+        init_db()
+
+    app.jinja_env.cache.clear()
+    started = time.perf_counter()
+    precompile_templates(app)
+    print(f'precompile: {len(app.jinja_env.cache)} templates in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+    print(f"{'dashboard':<10} {'inline ms':>10} {'p95':>8} {'cached ms':>10} {'p95':>8} {'speedup':>8}")
+    for role, (template, admission_number) in ROLES.items():
+        with app.test_request_context('/'):
+            conn = get_db()
+            user = conn.execute('SELECT id, name FROM users WHERE user_type = ? AND '
+                                '(? IS NULL OR admission_number = ?) ORDER BY id LIMIT 1',
+                                (role, admission_number, admission_number)).fetchone()
+            if user is None:
+                sys.exit(f'no {role} user in the database')
+            session.update(user_id=user['id'], user_type=role, user_name=user['name'])
+            data = dashboard(conn, role, user['id'])
+
+            def render():
+                return render_template(template, **with_fragments(role, lambda: dict(data)))
+
+            inline, inline_p95 = measure(render, args.iterations, fragment_cache.clear)
+            render()
+            cached, cached_p95 = measure(render, args.iterations)
+        print(f'{role:<10} {inline * 1000:>10.2f} {inline_p95 * 1000:>8.2f} '
+              f'{cached * 1000:>10.2f} {cached_p95 * 1000:>8.2f} {inline / cached:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
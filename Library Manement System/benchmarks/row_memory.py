@@ -0,0 +1,73 @@
+"""Compare memory and fetch time per 1k rows for sqlite3.Row, dict and compact records.
+
+    python -m benchmarks.row_memory [--rows 100000] [--seed 42]
+
+Builds books and users tables in memory from the datagen generators, then
+materialises each table three ways: sqlite3.Row from SELECT * (how pages and
+caches were built), dict(row) (the login and JSON path), and records.query_records
+with only the columns the application reads. "lazy" streams the cursor and
+keeps nothing, as the exports do. Memory is what tracemalloc sees retained
+after the fetch, values included.
+"""
+import argparse
+import gc
+import random
+import sqlite3
+import time
+import tracemalloc
+
+from benchmarks.datagen import generate_books, generate_users
+from migrations import MIGRATIONS
+from records import query_records
+
+TABLES = {
+    'books': 'id, title, author, category, code, available',
+    'users': 'id, user_type, name, admission_number, password',
+}
+
+def measure(fetch):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = fetch()
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return retained, peak, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(MIGRATIONS[0][2])
+    rng = random.Random(args.seed)
+    conn.executemany('INSERT INTO books (id, title, category, author, code, available) VALUES (?, ?, ?, ?, ?, 1)',
+                     generate_books(rng, 1, args.rows))
+    conn.executemany('''
+        INSERT INTO users (user_type, name, admission_number, class_name, section,
+                           roll_number, department, subject, phone, password)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', generate_users(rng, args.rows, 'scrypt:32768:8:1$' + 'x' * 16 + '$' + 'f' * 128))
+    conn.row_factory = sqlite3.Row
+
+    per_1k = args.rows / 1000
+    print(f'{args.rows:,} rows per table')
+    print(f"{'table':<6} {'representation':<28} {'KiB/1k rows':>12} {'peak KiB/1k':>12} {'ms/1k rows':>11}")
+    for table, columns in TABLES.items():
+        ways = {
+            'sqlite3.Row, SELECT *': lambda: conn.execute(f'SELECT * FROM {table}').fetchall(),
+            'dict(row), SELECT *': lambda: [dict(row) for row in conn.execute(f'SELECT * FROM {table}')],
+            'record, named columns': lambda: query_records(conn, f'SELECT {columns} FROM {table}').fetchall(),
+            'record, lazy (streamed)': lambda: sum(1 for _ in query_records(conn, f'SELECT {columns} FROM {table}')),
+        }
+        for name, fetch in ways.items():
+            retained, peak, elapsed = measure(fetch)
+            print(f'{table:<6} {name:<28} {retained / 1024 / per_1k:>12.1f} {peak / 1024 / per_1k:>12.1f} '
+                  f'{elapsed * 1000 / per_1k:>11.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Load-test the sync gunicorn and ASGI deployments with many concurrent dashboard users.
+
+    python -m benchmarks.serving [--servers sync asgi] [--workers 4] [--clients 200] [--duration 15]
+
+Each server runs against its own freshly seeded database. Every client logs in
+as the demo student once, then requests the dashboard in a loop over a
+keep-alive connection (reconnecting whenever the server closes it). Prints
+requests/sec and latency percentiles per server.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from urllib.parse import urlencode
+
+from benchmarks.common import HTTPClient, ServerProcess, free_port, run_closed_loop, wait_for_port
+
+SERVERS = {
+    'sync': ['gunicorn', '--workers', '{workers}', '--bind', '127.0.0.1:{port}', 'main:app'],
+    'asgi': ['uvicorn', 'asgi:application', '--workers', '{workers}', '--host', '127.0.0.1',
+             '--port', '{port}', '--no-access-log'],
+}
+
+LOGIN = {'user_type': 'student', 'admission_number': '7354', 'password': 'student123'}
+
+def login(port):
+    client = HTTPClient(port)
+    status, _ = client.request('POST', '/authenticate', urlencode(LOGIN),
+                               {'Content-Type': 'application/x-www-form-urlencoded'})
+    if status != 302:
+        raise RuntimeError(f'login failed with HTTP {status}')
+    return client
+
+def benchmark(name, args, directory):
+    env = dict(os.environ, LIBRARY_DB=os.path.join(directory, f'{name}.db'))
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'init-db'],
+                   env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    port = free_port()
+    command = [part.format(workers=args.workers, port=port) for part in SERVERS[name]]
+    with ServerProcess(command, env):
+        wait_for_port(port)
+        return run_closed_loop(lambda _: login(port),
+                               lambda client: client.request('GET', args.path)[0] == 200,
+                               args.clients, args.duration)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['sync', 'asgi'])
+    parser.add_argument('--workers', type=int, default=4, help='Server worker processes.')
+    parser.add_argument('--clients', type=int, default=200, help='Concurrent simulated users.')
+    parser.add_argument('--duration', type=float, default=15, help='Seconds of load per server.')
+    parser.add_argument('--path', default='/dashboard/student')
+    args = parser.parse_args()
+
+    print(f'{args.clients} clients, {args.workers} workers, {args.duration:g}s per server, GET {args.path}')
+    print(f"{'server':<6} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.servers:
+            result = benchmark(name, args, directory)
+            print(f"{name:<6} {result['requests']:>9} {result['errors']:>7} {result['rps']:>8.1f} "
+                  f"{result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} "
+                  f"{result['p99'] * 1000:>8.1f} {result['max'] * 1000:>8.1f}")
+
+if __name__ == '__main__':
+    main()
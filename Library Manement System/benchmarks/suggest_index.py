@@ -0,0 +1,92 @@
+"""Measure the typeahead prefix index: build time, memory and lookup latency.
+
+    python -m benchmarks.suggest_index [--titles 1000000] [--queries 2000] [--seed 42]
+
+Generates a catalogue with the datagen title and author generators into an
+in-memory books table, builds suggest.PrefixIndex from it and reports build
+time and the memory the index retains (tracemalloc, interned words included).
+Lookups are timed two ways: "index" is the bisect alone (candidates), "lookup"
+adds reading the rows back by primary key and ranking, which is what
+/api/v1/suggest does once the index is in sync. Queries are prefixes of 2-6
+characters of real title and author words, codes, and two-word prefixes.
+"""
+import argparse
+import gc
+import random
+import sqlite3
+import time
+import tracemalloc
+
+from benchmarks.common import percentile
+from benchmarks.datagen import generate_books
+from migrations import MIGRATIONS
+from suggest import SUGGEST_LIMIT, SUGGEST_SCAN, PrefixIndex, words
+
+def sample_queries(rng, books, count):
+    queries = []
+    for _ in range(count):
+        _, title, _, author, code = rng.choice(books)
+        kind = rng.random()
+        if kind < 0.5:
+            word = rng.choice([word for word in words(f'{title} {author}') if len(word) > 1])
+            queries.append(word[:rng.randint(2, 6)])
+        elif kind < 0.8:
+            first, second = rng.sample(words(title), 2) if len(words(title)) > 1 else (title, title)
+            queries.append(f'{first} {second[:rng.randint(1, 4)]}')
+        else:
+            queries.append(code[:rng.randint(4, len(code))])
+    return queries
+
+def timed(run, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        run(query)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return sum(timings) / len(timings), percentile(timings, 0.50), percentile(timings, 0.95), percentile(timings, 0.99)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--titles', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    books = list(generate_books(rng, 1, args.titles))
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(MIGRATIONS[0][2])
+    conn.executemany('INSERT INTO books (id, title, category, author, code) VALUES (?, ?, ?, ?, ?)', books)
+    rows = [(book_id, title, author, code) for book_id, title, _, author, code in books]
+
+    index = PrefixIndex()
+    started = time.perf_counter()
+    index.load(rows)
+    build = time.perf_counter() - started
+    entries = index.stats()['entries']
+
+    index = None
+    gc.collect()
+    tracemalloc.start()
+    index = PrefixIndex()
+    index.load(rows)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{args.titles:,} titles, {entries:,} index entries')
+    print(f'build: {build:.2f} s ({build / args.titles * 1e6:.2f} us/title)')
+    print(f'memory: {retained / 1048576:.1f} MiB retained ({retained / args.titles:.0f} B/title), '
+          f'{peak / 1048576:.1f} MiB peak while building')
+
+    queries = sample_queries(rng, books, args.queries)
+    scan = max(SUGGEST_LIMIT, SUGGEST_SCAN)
+    print(f"{'path':<8} {'mean ms':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, run in (('index', lambda query: index.candidates(words(query), scan)),
+                      ('lookup', lambda query: index.lookup(conn, query))):
+        run(queries[0])
+        mean, p50, p95, p99 = timed(run, queries)
+        print(f'{name:<8} {mean * 1000:>9.3f} {p50 * 1000:>8.3f} {p95 * 1000:>8.3f} {p99 * 1000:>8.3f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Run scripted scenarios against a library and compare them with a stored baseline.
+
+    python -m benchmarks.datagen /tmp/bench.db --size medium
+    python -m benchmarks.suite /tmp/bench.db [--target client|gunicorn] [--scenarios ...]
+                               [--clients 8] [--duration 10] [--output results.json]
+                               [--baseline benchmarks/baseline.json] [--tolerance 0.2]
+
+Scenarios:
+  student_dashboard  generated students load their dashboard
+  admin_dashboard    the admin dashboard with its catalogue and loan pages
+  search             full-text catalogue search for random title words
+  issue_return       admin issues a batch of books and returns them (one sample per pair)
+
+The client target drives the Flask test client in this process; gunicorn
+starts a real server on the database. With --baseline, a scenario whose
+req/s drops or whose p95 grows by more than --tolerance is a regression and
+the exit status is 1.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+from urllib.parse import urlencode
+
+from benchmarks.common import HTTPClient, ServerProcess, free_port, run_closed_loop, wait_for_port
+from benchmarks.datagen import ADJECTIVES, NOUNS
+
+FORM = {'Content-Type': 'application/x-www-form-urlencoded'}
+JSON = {'Content-Type': 'application/json'}
+ADMIN = {'user_type': 'admin', 'phone': '7382950164', 'password': 'Admin 0011'}
+DEMO_STUDENT = {'user_type': 'student', 'admission_number': '7354', 'password': 'student123'}
+SEARCH_WORDS = [word.lower() for word in ADJECTIVES + NOUNS] + ['harry', 'tolkien', 'dickens', 'shakespeare']
+
+class FlaskClient:
+    """Test-client adapter with the same request() as HTTPClient"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        return response.status_code, response.get_data()
+
+def login(client, credentials):
+    status, _ = client.request('POST', '/authenticate', urlencode(credentials), FORM)
+    if status != 302:
+        raise RuntimeError(f'login failed with HTTP {status}')
+    return client
+
+class Library:
+    """What the scenarios need to know about the database under test"""
+
+    def __init__(self, path, sample=1000):
+        conn = sqlite3.connect(path)
+        self.students = [row[0] for row in conn.execute('''
+            SELECT admission_number FROM users
+            WHERE user_type = 'student' AND admission_number LIKE 'S%'
+            LIMIT ?
+        ''', (sample,))]
+        self.borrowers = [row[0] for row in conn.execute(
+            "SELECT id FROM users WHERE user_type != 'admin' LIMIT ?", (sample,))]
+        self.available_books = [row[0] for row in conn.execute(
+            'SELECT id FROM books WHERE available = 1 ORDER BY random() LIMIT ?', (sample * 10,))]
+        self.counts = dict(zip(('books', 'users', 'transactions'), conn.execute('''
+            SELECT (SELECT COUNT(*) FROM books), (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM transactions)
+        ''').fetchone()))
+        conn.close()
+
+    def student_credentials(self, number):
+        if not self.students:
+            return DEMO_STUDENT
+        return {'user_type': 'student', 'admission_number': self.students[number % len(self.students)],
+                'password': 'password'}
+
+def student_dashboard(library, clients, new_client):
+    def setup(number):
+        return login(new_client(), library.student_credentials(number))
+    return setup, lambda client: client.request('GET', '/dashboard/student')[0] == 200
+
+def admin_dashboard(library, clients, new_client):
+    return (lambda number: login(new_client(), ADMIN),
+            lambda client: client.request('GET', '/dashboard/admin')[0] == 200)
+
+def search(library, clients, new_client):
+    def setup(number):
+        return login(new_client(), library.student_credentials(number)), random.Random(number)
+
+    def step(state):
+        client, rng = state
+        query = urlencode({'q': rng.choice(SEARCH_WORDS)})
+        return client.request('GET', f'/search?{query}')[0] == 200
+    return setup, step
+
+def issue_return(library, clients, new_client, batch=10):
+    def setup(number):
+        # Each client cycles through its own books so batches do not collide
+        books = library.available_books[number::clients]
+        if len(books) < batch:
+            raise RuntimeError('not enough available books for issue_return; generate a bigger library')
+        return login(new_client(), ADMIN), books, random.Random(number), [0]
+
+    def step(state):
+        client, books, rng, position = state
+        start = position[0] % (len(books) - batch + 1)
+        position[0] += batch
+        loans = [{'book_id': book_id, 'user_id': rng.choice(library.borrowers)}
+                 for book_id in books[start:start + batch]]
+        status, body = client.request('POST', '/admin/issue_batch', json.dumps({'loans': loans}), JSON)
+        if status != 200:
+            return False
+        issued = [result['transaction_id'] for result in json.loads(body)['results'] if result['ok']]
+        if not issued:
+            return False
+        status, body = client.request('POST', '/admin/return_batch', json.dumps({'transaction_ids': issued}), JSON)
+        return status == 200 and json.loads(body)['returned'] == len(issued)
+    return setup, step
+
+SCENARIOS = {
+    'student_dashboard': student_dashboard,
+    'admin_dashboard': admin_dashboard,
+    'search': search,
+    'issue_return': issue_return,
+}
+
+def compare(results, baseline, tolerance):
+    """Return (scenario, message) for every regression against the baseline"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        if before['rps'] and result['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append((name, f"req/s {result['rps']:.1f} vs baseline {before['rps']:.1f}"))
+        if before['p95'] and result['p95'] > before['p95'] * (1 + tolerance):
+            regressions.append((name, f"p95 {result['p95'] * 1000:.1f} ms vs baseline {before['p95'] * 1000:.1f} ms"))
+    return regressions
+
+def run(args, library, new_client):
+    results = {}
+    print(f"{'scenario':<18} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name in args.scenarios:
+        setup, step = SCENARIOS[name](library, args.clients, new_client)
+        result = results[name] = run_closed_loop(setup, step, args.clients, args.duration)
+        print(f"{name:<18} {result['requests']:>9} {result['errors']:>7} {result['rps']:>8.1f} "
+              f"{result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog='\n'.join(__doc__.splitlines()[1:]))
+    parser.add_argument('database', help='A library built by benchmarks.datagen (it is modified by issue_return).')
+    parser.add_argument('--target', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent simulated users.')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per scenario.')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes.')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker.')
+    parser.add_argument('--output', help='Write the results as JSON (use it as a later --baseline).')
+    parser.add_argument('--baseline', help='JSON results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed fractional slowdown.')
+    args = parser.parse_args()
+
+    library = Library(args.database)
+    meta = dict(library.counts, target=args.target, clients=args.clients, duration=args.duration)
+    print(', '.join(f'{key}={value}' for key, value in meta.items()))
+
+    if args.target == 'client':
+        os.environ['LIBRARY_DB'] = args.database
+        from main import app
+        results = run(args, library, lambda: FlaskClient(app))
+    else:
+        port = free_port()
+        command = ['gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+                   '--bind', f'127.0.0.1:{port}', 'main:app']
+        with ServerProcess(command, dict(os.environ, LIBRARY_DB=args.database)):
+            wait_for_port(port)
+            results = run(args, library, lambda: HTTPClient(port))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'meta': meta, 'results': results}, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        for key in ('target', 'clients', 'books', 'users'):
+            if baseline.get('meta', {}).get(key) != meta[key]:
+                print(f"warning: baseline {key} was {baseline.get('meta', {}).get(key)}, this run {meta[key]}")
+        regressions = compare(results, baseline, args.tolerance)
+        for name, message in regressions:
+            print(f'REGRESSION {name}: {message}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""Streaming bulk import/export of books and users as CSV or JSONL"""
+import csv
+import io
+import json
+import os
+import sqlite3
+import time
+from itertools import islice
+
+from auth import hash_passwords
+from database import MAX_COPIES, free_barcodes, generations
+
+BOOK_FIELDS = ('title', 'category', 'author', 'code')
+USER_FIELDS = ('user_type', 'name', 'admission_number', 'class_name', 'section',
+               'roll_number', 'department', 'subject', 'phone', 'password')
+# Passwords are never exported
+USER_EXPORT_FIELDS = ('id',) + USER_FIELDS[:-1]
+# `copies` (optional on import, default 1) is the number of copies of the title
+BOOK_EXPORT_FIELDS = ('id',) + BOOK_FIELDS + ('copies', 'copies_available', 'available')
+# Largest user file the admin page imports: each password is a KDF run, and the whole
+# file has to be hashed within one request. Bigger files go through `flask import users`.
+MAX_WEB_USER_IMPORT = int(os.environ.get('MAX_WEB_USER_IMPORT', 200))
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def read_records(stream, fmt):
+    """Yield (line number, dict) pairs from a text stream without loading it whole"""
+    if fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_number, record if isinstance(record, dict) else None
+    else:
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def clean(record, fields):
+    return {field: (str(record.get(field) or '').strip() or None) for field in fields}
+
+def copies_of(record):
+    """The record's copy count, 1 if absent, or None if it is not a valid count"""
+    value = record.get('copies')
+    # Only a missing key or an empty CSV cell means the default; a JSONL 0 is a bad count
+    if value is None or str(value).strip() == '':
+        return 1
+    try:
+        copies = int(str(value).strip())
+    except ValueError:
+        return None
+    return copies if 1 <= copies <= MAX_COPIES else None
+
+class ImportReport:
+    """Counts and rejects for one import run"""
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def reject(self, line_number, reason):
+        self.rejected.append((line_number, reason))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        self.rejected.sort()
+        return self
+
+    @property
+    def rows_per_second(self):
+        total = self.accepted + len(self.rejected)
+        return total / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self, max_rejects=100):
+        return {
+            'accepted': self.accepted,
+            'rejected': len(self.rejected),
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second),
+            'rejects': [{'line': line, 'reason': reason} for line, reason in self.rejected[:max_rejects]],
+        }
+
+    def summary(self):
+        return (f'{self.accepted} imported, {len(self.rejected)} rejected '
+                f'in {self.elapsed:.2f}s ({self.rows_per_second:,.0f} rows/s)')
+
+def insert_chunk(conn, report, rows, insert):
+    """Run insert(conn, rows) for a chunk of (line_number, row) pairs in one transaction.
+    The checks before it should rule out constraint failures; if one still happens, redo
+    the chunk a row at a time so only the offending lines are rejected."""
+    try:
+        with conn:
+            insert(conn, [row for _, row in rows])
+        report.accepted += len(rows)
+        return
+    except sqlite3.IntegrityError:
+        pass
+    for line_number, row in rows:
+        try:
+            with conn:
+                insert(conn, [row])
+            report.accepted += 1
+        except sqlite3.IntegrityError as e:
+            report.reject(line_number, str(e))
+
+def existing_values(conn, sql, values):
+    """Return the subset of values already present, looked up in one IN (...) query"""
+    if not values:
+        return set()
+    placeholders = ', '.join('?' * len(values))
+    return {row[0] for row in conn.execute(sql.format(placeholders=placeholders), list(values))}
+
+def import_books(conn, records, batch_size=5000):
+    """Insert new books and their copies in executemany batches, one transaction per batch"""
+    report = ImportReport()
+    seen_codes = set()
+    for chunk in chunked(records, batch_size):
+        candidates = []
+        for line_number, record in chunk:
+            if record is None:
+                report.reject(line_number, 'malformed record')
+                continue
+            book = clean(record, BOOK_FIELDS)
+            book['copies'] = copies_of(record)
+            missing = [field for field in BOOK_FIELDS if not book[field]]
+            if missing:
+                report.reject(line_number, f"missing {', '.join(missing)}")
+            elif book['copies'] is None:
+                report.reject(line_number, f'copies must be a whole number from 1 to {MAX_COPIES}')
+            elif book['code'] in seen_codes:
+                report.reject(line_number, f"duplicate code {book['code']} in file")
+            else:
+                seen_codes.add(book['code'])
+                candidates.append((line_number, book))
+
+        codes = {book['code'] for _, book in candidates}
+        taken = existing_values(conn, 'SELECT code FROM books WHERE code IN ({placeholders})', codes)
+        # A title's first copy is barcoded with its code, which must not already be a
+        # barcode: another title's CODE-N copy
+        barcodes = existing_values(conn, 'SELECT barcode FROM book_copies WHERE barcode IN ({placeholders})', codes)
+        books = []
+        for line_number, book in candidates:
+            if book['code'] in taken:
+                report.reject(line_number, f"code {book['code']} already exists")
+            elif book['code'] in barcodes:
+                report.reject(line_number, f"code {book['code']} is already the barcode of another book's copy")
+            else:
+                books.append((line_number, book))
+
+        insert_chunk(conn, report, books, insert_books)
+        generations.bump('books')
+    return report.finish()
+
+def insert_books(conn, books):
+    conn.executemany('''
+        INSERT INTO books (title, category, author, code)
+        VALUES (?, ?, ?, ?)
+    ''', [tuple(book[field] for field in BOOK_FIELDS) for book in books])
+    if not books:
+        return
+    ids = dict(conn.execute(f'''
+        SELECT code, id FROM books WHERE code IN ({', '.join('?' * len(books))})
+    ''', [book['code'] for book in books]))
+    copies = [(ids[book['code']], book['code']) for book in books]
+    # Later copies skip numbers whose CODE-N is taken, including by a title in this batch
+    reserved = set(ids)
+    for book in books:
+        if book['copies'] > 1:
+            extra = free_barcodes(conn, book['code'], 2, book['copies'] - 1, reserved)
+            reserved.update(extra)
+            copies += [(ids[book['code']], barcode) for barcode in extra]
+    conn.executemany('INSERT INTO book_copies (book_id, barcode) VALUES (?, ?)', copies)
+
+def user_key(user):
+    """Identity used to de-duplicate users, matching the admin registration checks"""
+    if user['user_type'] == 'student':
+        return ('student', user['admission_number'])
+    return ('employee', user['name'], user['department'])
+
+def validate_user(user):
+    if user['user_type'] == 'student':
+        required = ('admission_number', 'password')
+    elif user['user_type'] == 'employee':
+        required = ('name', 'department', 'password')
+    else:
+        return 'user_type must be student or employee'
+    missing = [field for field in required if not user[field]]
+    return f"missing {', '.join(missing)}" if missing else None
+
+def import_users(conn, records, batch_size=5000):
+    """Insert new students and employees in executemany batches"""
+    report = ImportReport()
+    seen = set()
+    for chunk in chunked(records, batch_size):
+        candidates = []
+        for line_number, record in chunk:
+            if record is None:
+                report.reject(line_number, 'malformed record')
+                continue
+            user = clean(record, USER_FIELDS)
+            user['user_type'] = (user['user_type'] or 'student').lower()
+            problem = validate_user(user)
+            if problem:
+                report.reject(line_number, problem)
+            elif user_key(user) in seen:
+                report.reject(line_number, 'duplicate user in file')
+            else:
+                seen.add(user_key(user))
+                candidates.append((line_number, user))
+
+        taken_admissions = existing_values(conn, '''
+            SELECT admission_number FROM users
+            WHERE user_type = 'student' AND admission_number IN ({placeholders})
+        ''', {user['admission_number'] for _, user in candidates if user['user_type'] == 'student'})
+        taken_names = existing_values(conn, '''
+            SELECT name || char(0) || department FROM users
+            WHERE user_type = 'employee' AND name IN ({placeholders})
+        ''', {user['name'] for _, user in candidates if user['user_type'] == 'employee'})
+        accepted = []
+        for line_number, user in candidates:
+            if user['user_type'] == 'student' and user['admission_number'] in taken_admissions:
+                report.reject(line_number, f"admission number {user['admission_number']} already exists")
+            elif user['user_type'] == 'employee' and f"{user['name']}\0{user['department']}" in taken_names:
+                report.reject(line_number, 'employee with this name and department already exists')
+            else:
+                accepted.append((line_number, user))
+        # The KDF dominates an import, so hash the chunk across cores
+        for (_, user), hashed in zip(accepted, hash_passwords([user['password'] for _, user in accepted])):
+            user['password'] = hashed
+
+        insert_chunk(conn, report, accepted, insert_users)
+        generations.bump('users')
+    return report.finish()
+
+def insert_users(conn, users):
+    conn.executemany(f'''
+        INSERT INTO users ({', '.join(USER_FIELDS)})
+        VALUES ({', '.join('?' * len(USER_FIELDS))})
+    ''', [tuple(user[field] for field in USER_FIELDS) for user in users])
+
+def stream_rows(rows, fields, fmt):
+    """Serialise a row iterator to CSV or JSONL text one line at a time"""
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row)), ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # The header alone when there are no rows
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+def export_books(conn, fmt='csv'):
+    rows = conn.execute(f'''
+        SELECT id, {', '.join(BOOK_FIELDS)}, copies_total, copies_available, available FROM books ORDER BY id
+    ''')
+    return stream_rows(rows, BOOK_EXPORT_FIELDS, fmt)
+
+def export_users(conn, fmt='csv'):
+    rows = conn.execute(f'''
+        SELECT {', '.join(USER_EXPORT_FIELDS)} FROM users
+        WHERE user_type != 'admin' ORDER BY id
+    ''')
+    return stream_rows(rows, USER_EXPORT_FIELDS, fmt)
+
+IMPORTERS = {'books': import_books, 'users': import_users}
+EXPORTERS = {'books': export_books, 'users': export_users}
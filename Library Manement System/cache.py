@@ -0,0 +1,160 @@
+"""In-process LRU/TTL cache keyed by change generations shared across workers"""
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: generations are per process only
+    fcntl = None
+
+class Generations:
+    """Per-table change counters kept in a small memory-mapped file.
+
+    Every worker process maps the same file, so a bump made after a commit in
+    one worker is seen by the others on their next read, without a database
+    round-trip. Readers fold the counters into cache keys (and ETags), so a
+    bump makes every older entry unreachable.
+
+    A random instance number follows the counters, written once when the file
+    is created. Counters start again at 0 in a recreated file, so anything
+    that outlives a worker (an ETag held by a client) must include it too.
+    """
+
+    SLOT = struct.Struct('<Q')
+
+    def __init__(self, path, names=('books', 'transactions', 'users', 'sessions')):
+        self.path = path
+        self.names = names
+        self._map = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        with self._lock:
+            if self._map is None:
+                size = self.SLOT.size * (len(self.names) + 1)
+                self._file = open(self.path, 'a+b')
+                if fcntl:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                try:
+                    if os.fstat(self._file.fileno()).st_size < size:
+                        self._file.truncate(size)
+                    self._map = mmap.mmap(self._file.fileno(), size)
+                    offset = self.SLOT.size * len(self.names)
+                    if not self.SLOT.unpack_from(self._map, offset)[0]:
+                        self.SLOT.pack_into(self._map, offset, int.from_bytes(os.urandom(8), 'little') or 1)
+                finally:
+                    if fcntl:
+                        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        return self._map
+
+    @property
+    def instance(self):
+        """Random number identifying this counter file; changes when the file is recreated"""
+        data = self._map or self._open()
+        return self.SLOT.unpack_from(data, self.SLOT.size * len(self.names))[0]
+
+    def get(self, name):
+        data = self._map or self._open()
+        return self.SLOT.unpack_from(data, self.SLOT.size * self.names.index(name))[0]
+
+    def snapshot(self, *names):
+        return tuple(self.get(name) for name in names or self.names)
+
+    def bump(self, *names):
+        """Invalidate everything derived from the named tables; call after commit"""
+        data = self._map or self._open()
+        with self._lock:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                for name in names:
+                    offset = self.SLOT.size * self.names.index(name)
+                    self.SLOT.pack_into(data, offset, self.SLOT.unpack_from(data, offset)[0] + 1)
+            finally:
+                if fcntl:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+class Load:
+    """One in-flight loader() call that other threads missing on its key wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.value = None
+
+class LRUCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize=128, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # key -> Load for the misses being loaded right now
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss.
+
+        Misses are single-flight: while one thread runs loader() for a key, other
+        threads missing on it wait for that value instead of loading it again.
+        """
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                load = self._loading.get(key)
+                if load is None:
+                    load = self._loading[key] = Load()
+                    self.misses += 1
+                    break
+            load.done.wait()
+            if load.ok:
+                with self._lock:
+                    self.hits += 1
+                return load.value
+            # The loader raised; the next thread through retries it
+        try:
+            load.value = loader()
+            load.ok = True
+            self.put(key, load.value)
+            return load.value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            load.done.set()
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,206 @@
+"""Issue and return books, one at a time or in atomic batches"""
+import sqlite3
+from collections import Counter
+from datetime import datetime
+
+from database import generations
+
+MAX_BATCH = 1000
+
+# Flip the lowest-numbered shelf copy of a title to on_loan, returning its id
+CLAIM_COPY = '''
+    UPDATE book_copies SET status = 'on_loan'
+    WHERE id = (SELECT id FROM book_copies WHERE book_id = ? AND status = 'available' ORDER BY id LIMIT 1)
+    RETURNING id
+'''
+OPEN_LOANS_FOR_BOOK = '''
+    SELECT COUNT(*) as count FROM transactions
+    WHERE book_id = ? AND status = 'issued'
+'''
+
+def today():
+    return datetime.now().strftime('%Y-%m-%d')
+
+def placeholders(values):
+    return ', '.join('?' * len(values))
+
+def as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def issue_book(conn, book_id, user_id):
+    """Issue a shelf copy of one title with a single conditional write.
+
+    Returns the new transaction id, or None if the title is missing or has no
+    copy on the shelf. Safe against concurrent desks: only the writer whose
+    UPDATE flips a copy from available to on_loan gets to create the loan.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        claimed = conn.execute(CLAIM_COPY, (book_id,)).fetchone()
+        if claimed is None:
+            conn.rollback()
+            return None
+        transaction_id = conn.execute('''
+            INSERT INTO transactions (user_id, book_id, copy_id, issue_date, status)
+            VALUES (?, ?, ?, ?, 'issued')
+        ''', (user_id, book_id, claimed[0], today())).lastrowid
+        conn.commit()
+        generations.bump('books', 'transactions')
+        return transaction_id
+    except sqlite3.IntegrityError:
+        # The one-open-loan-per-copy index caught a loan the copy status did not
+        conn.rollback()
+        return None
+    except Exception:
+        conn.rollback()
+        raise
+
+def return_loan(conn, transaction_id):
+    """Close one open loan and put its copy back on the shelf. Returns False if it was not open."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        closed = conn.execute('''
+            UPDATE transactions SET status = 'returned', return_date = ?
+            WHERE id = ? AND status = 'issued'
+            RETURNING copy_id
+        ''', (today(), transaction_id)).fetchone()
+        if closed is None:
+            conn.rollback()
+            return False
+        conn.execute("UPDATE book_copies SET status = 'available' WHERE id = ?", (closed[0],))
+        conn.commit()
+        generations.bump('books', 'transactions')
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+def issue_books(conn, loans):
+    """Issue a batch of (book_id, user_id) pairs in one BEGIN IMMEDIATE transaction.
+
+    Each pair takes one shelf copy of its title, so a title can appear as many
+    times as it has copies (a class set). Returns one result dict per input
+    pair, in order. Pairs that cannot be issued are reported individually; they
+    do not abort the rest of the batch.
+    """
+    results = [{'book_id': book_id, 'user_id': user_id} for book_id, user_id in loans]
+    wanted = []
+    for result in results:
+        book_id, user_id = as_id(result['book_id']), as_id(result['user_id'])
+        if book_id is None or user_id is None:
+            result['error'] = 'book_id and user_id must be integers'
+        else:
+            result['book_id'], result['user_id'] = book_id, user_id
+            wanted.append(result)
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        user_ids = list({result['user_id'] for result in wanted})
+        borrowers = {row[0] for row in conn.execute(f'''
+            SELECT id FROM users WHERE user_type != 'admin' AND id IN ({placeholders(user_ids)})
+        ''', user_ids)} if user_ids else set()
+        for result in wanted:
+            if result['user_id'] not in borrowers:
+                result['error'] = 'user not found'
+        wanted = [result for result in wanted if 'error' not in result]
+
+        # Claim up to the requested number of shelf copies of every title at once
+        copies_wanted = Counter(result['book_id'] for result in wanted)
+        claimed = {}
+        if copies_wanted:
+            for copy_id, book_id, barcode in conn.execute(f'''
+                WITH wanted (book_id, copies) AS (VALUES {', '.join(['(?, ?)'] * len(copies_wanted))}),
+                shelf AS (
+                    SELECT c.id, w.copies, ROW_NUMBER() OVER (PARTITION BY c.book_id ORDER BY c.id) AS n
+                    FROM wanted w
+                    JOIN book_copies c ON c.book_id = w.book_id AND c.status = 'available'
+                )
+                UPDATE book_copies SET status = 'on_loan'
+                WHERE id IN (SELECT id FROM shelf WHERE n <= copies)
+                RETURNING id, book_id, barcode
+            ''', [value for item in copies_wanted.items() for value in item]):
+                claimed.setdefault(book_id, []).append((copy_id, barcode))
+        for copies in claimed.values():
+            copies.sort(reverse=True)  # pop() hands out the lowest copy ids first
+
+        issued, short = [], []
+        for result in wanted:
+            copies = claimed.get(result['book_id'])
+            if copies:
+                result['copy_id'], result['barcode'] = copies.pop()
+                issued.append(result)
+            else:
+                short.append(result)
+
+        short_ids = list({result['book_id'] for result in short})
+        existing = {row[0] for row in conn.execute(f'''
+            SELECT id FROM books WHERE id IN ({placeholders(short_ids)})
+        ''', short_ids)} if short_ids else set()
+        for result in short:
+            result['error'] = 'book is not available' if result['book_id'] in existing else 'book not found'
+
+        if issued:
+            issue_date = today()
+            by_copy = {result['copy_id']: result for result in issued}
+            rows = [(result['user_id'], result['book_id'], result['copy_id'], issue_date) for result in issued]
+            inserted = conn.execute(f'''
+                INSERT INTO transactions (user_id, book_id, copy_id, issue_date, status)
+                VALUES {', '.join(["(?, ?, ?, ?, 'issued')"] * len(rows))}
+                RETURNING id, copy_id, issue_date
+            ''', [value for row in rows for value in row]).fetchall()
+            for transaction_id, copy_id, issue_date in inserted:
+                by_copy[copy_id].update(transaction_id=transaction_id, issue_date=issue_date)
+        conn.commit()
+        generations.bump('books', 'transactions')
+    except Exception:
+        conn.rollback()
+        raise
+
+    for result in results:
+        result['ok'] = 'error' not in result
+    return results
+
+def return_loans(conn, transaction_ids):
+    """Return a batch of open loans by transaction id in one BEGIN IMMEDIATE transaction"""
+    results = [{'transaction_id': transaction_id} for transaction_id in transaction_ids]
+    wanted = {}
+    for result in results:
+        transaction_id = as_id(result['transaction_id'])
+        if transaction_id is None:
+            result['error'] = 'transaction_id must be an integer'
+        elif transaction_id in wanted:
+            result['error'] = 'transaction appears more than once in this batch'
+        else:
+            result['transaction_id'] = transaction_id
+            wanted[transaction_id] = result
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        ids = list(wanted)
+        returned = conn.execute(f'''
+            UPDATE transactions SET status = 'returned', return_date = ?
+            WHERE status = 'issued' AND id IN ({placeholders(ids)})
+            RETURNING id, book_id, return_date, copy_id
+        ''', [today()] + ids).fetchall() if ids else []
+
+        copy_ids = [copy_id for _, _, _, copy_id in returned]
+        if copy_ids:
+            conn.execute(f'''
+                UPDATE book_copies SET status = 'available' WHERE id IN ({placeholders(copy_ids)})
+            ''', copy_ids)
+        conn.commit()
+        generations.bump('books', 'transactions')
+    except Exception:
+        conn.rollback()
+        raise
+
+    for transaction_id, book_id, return_date, _ in returned:
+        wanted[transaction_id].update(book_id=book_id, return_date=return_date)
+    for result in results:
+        if 'error' not in result and 'return_date' not in result:
+            result['error'] = 'no open loan with this id'
+        result['ok'] = 'error' not in result
+    return results
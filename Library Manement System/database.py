@@ -1,207 +1,412 @@
+import os
+import re
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 
-def get_db_connection():
-    conn = sqlite3.connect('library.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+from flask import g
 
-def init_db():
-    conn = get_db_connection()
+from auth import hash_passwords
+from cache import Generations, LRUCache
+from migrations import LATEST_VERSION, current_version, migrate
+from records import query_records
+
+DATABASE = os.environ.get('LIBRARY_DB', 'library.db')
+
+# What book pages and caches select, by name so the records stay narrow
+BOOK_COLUMNS = ('id', 'title', 'author', 'category', 'code', 'available', 'copies_available', 'copies_total')
+
+# Applied once when a pooled connection is opened, not on every request
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -16000),
+    ('busy_timeout', 5000),
+)
+# Request handlers read through these: WAL readers see the last commit and never wait for the writer
+READ_ONLY_PRAGMAS = PRAGMAS + (('query_only', 1),)
+
+class ConnectionPool:
+    """Bounded pool of tuned SQLite connections shared by the worker threads"""
+
+    def __init__(self, database, max_connections=16, pragmas=PRAGMAS):
+        self.database = database
+        self.max_connections = max_connections
+        self.pragmas = pragmas
+        # Swapped for metrics.InstrumentedConnection when instrumentation is on
+        self.factory = sqlite3.Connection
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, cached_statements=256,
+                               factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        """Check out a connection, reusing the most recently released one"""
+        with self._cond:
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            if self._open >= self.max_connections:
+                started = time.perf_counter()
+                self.waits += 1
+                while not self._idle:
+                    self._cond.wait()
+                self.wait_time += time.perf_counter() - started
+                self.hits += 1
+                return self._idle.pop()
+            self._open += 1
+            self.misses += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._open -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'wait_time_seconds': round(self.wait_time, 6),
+                'open': self._open,
+                'idle': len(self._idle),
+            }
+
+class Writer:
+    """Runs this process's request writes one at a time on a single connection.
+
+    run(fn, *args) waits its turn for the writer connection, calls fn(conn,
+    *args) on it and returns the result; fn commits as it would on any
+    connection, and whatever it leaves uncommitted is rolled back. Desks queue
+    on a lock in this process instead of sleeping in busy_timeout for SQLite's
+    write lock, and the read pool never writes, so a burst of issues and
+    returns cannot take connections from dashboards. Imports, the job runner
+    and CLI commands write on their own connections and still wait for the
+    write lock through busy_timeout.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._conn = None
+        self._lock = threading.Lock()
+        self._owner = None
+        self.writes = 0
+        self.failures = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.busy_time = 0.0
+
+    def run(self, fn, *args):
+        """Run fn(conn, *args) on the writer connection and return what it returns"""
+        if self._owner == threading.get_ident():
+            raise RuntimeError('Writer.run() called from inside a write')
+        queued = time.perf_counter()
+        with self._lock:
+            self._owner = threading.get_ident()
+            started = time.perf_counter()
+            failed = True
+            try:
+                if self._conn is None:
+                    self._conn = self.pool.acquire()
+                result = fn(self._conn, *args)
+                failed = False
+                return result
+            finally:
+                self._finish()
+                self._owner = None
+                self.writes += 1
+                self.failures += failed
+                self.wait_time += started - queued
+                self.max_wait = max(self.max_wait, started - queued)
+                self.busy_time += time.perf_counter() - started
+
+    def _finish(self):
+        conn = self._conn
+        try:
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection: the pool closes it and the next write opens a fresh one
+            self._conn = None
+            self.pool.release(conn)
+
+    def stats(self):
+        return {
+            'writes': self.writes,
+            'failures': self.failures,
+            'wait_time_seconds': round(self.wait_time, 6),
+            'max_wait_seconds': round(self.max_wait, 6),
+            'busy_time_seconds': round(self.busy_time, 6),
+        }
+
+# Read-write connections: the writer's, plus the job runner, imports and CLI commands
+pool = ConnectionPool(DATABASE, int(os.environ.get('LIBRARY_DB_WRITE_POOL_SIZE', 8)))
+# Query-only connections for request handlers
+read_pool = ConnectionPool(DATABASE, int(os.environ.get('LIBRARY_DB_POOL_SIZE', 16)), READ_ONLY_PRAGMAS)
+writer = Writer(pool)
+
+# Catalogue reads are cached until a write bumps the books generation
+generations = Generations(DATABASE + '-generations')
+catalogue_cache = LRUCache(maxsize=64, ttl=int(os.environ.get('CATALOGUE_CACHE_TTL', 300)))
+
+def get_db():
+    """Get a read-write connection bound to the current app context, for CLI commands and imports"""
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+def get_read_db():
+    """Get the query-only connection bound to the current app context; writes go through write()"""
+    if 'read_db' not in g:
+        g.read_db = read_pool.acquire()
+    return g.read_db
+
+def write(fn, *args):
+    """Run fn(conn, *args) on this process's single writer connection"""
+    return writer.run(fn, *args)
+
+def close_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+    conn = g.pop('read_db', None)
+    if conn is not None:
+        read_pool.release(conn)
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+
+def cached_catalogue(name, loader):
+    return catalogue_cache.get((name, generations.get('books')), loader)
+
+def get_available_count(conn):
+    """Number of titles with a copy on the shelf, shared by every dashboard until books change"""
+    return cached_catalogue('available_count', lambda: conn.execute('''
+        SELECT COUNT(*) FROM books WHERE available = 1
+    ''').fetchone()[0])
+
+def get_categories(conn):
+    return cached_catalogue('categories', lambda: [row[0] for row in conn.execute('''
+        SELECT DISTINCT category FROM books ORDER BY category
+    ''')])
+
+# Most copies added to a title in one go (a class set is well under this)
+MAX_COPIES = 500
+
+def copy_barcode(code, number):
+    """Barcode of a title's number-th copy: the book code itself, then CODE-2, CODE-3, ..."""
+    return code if number == 1 else f'{code}-{number}'
+
+def free_barcodes(conn, code, first, count, reserved=()):
+    """Barcodes for count copies of a title from its first-th copy on. Codes are free
+    text, so CODE-N may already be another title's code (and its first copy's barcode):
+    numbers whose barcode is in use, or in reserved, are skipped."""
+    barcodes, number = [], first
+    while len(barcodes) < count:
+        wanted = [copy_barcode(code, n) for n in range(number, number + count - len(barcodes))]
+        number += len(wanted)
+        taken = {row[0] for row in conn.execute(f'''
+            SELECT barcode FROM book_copies WHERE barcode IN ({', '.join('?' * len(wanted))})
+        ''', wanted)}
+        barcodes += [barcode for barcode in wanted if barcode not in taken and barcode not in reserved]
+    return barcodes
+
+def barcode_in_use(conn, barcode):
+    return conn.execute('SELECT 1 FROM book_copies WHERE barcode = ?', (barcode,)).fetchone() is not None
+
+def add_copies(conn, book_id, count):
+    """Shelve count more copies of a title; the caller commits and bumps `books`"""
+    book = conn.execute('SELECT code, copies_total FROM books WHERE id = ?', (book_id,)).fetchone()
+    if book is None:
+        return False
+    conn.executemany('INSERT INTO book_copies (book_id, barcode) VALUES (?, ?)', [
+        (book_id, barcode) for barcode in free_barcodes(conn, book['code'], book['copies_total'] + 1, count)
+    ])
+    return True
+
+def fts_query(text):
+    """Turn free text into an FTS5 prefix query, e.g. 'harry pot' -> '"harry"* "pot"*'"""
+    tokens = re.findall(r'\w+', text.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+def search_books(conn, text, limit=100):
+    """Full-text search over title, author, category and code ranked by bm25"""
+    match = fts_query(text)
+    if not match:
+        return []
+    return query_records(conn, f'''
+        SELECT {', '.join('b.' + column for column in BOOK_COLUMNS)} FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        WHERE books_fts MATCH ?
+        ORDER BY books_fts.rank
+        LIMIT ?
+    ''', (match, limit)).fetchall()
+
+SEED_USERS = [
+    # (user_type, name, admission_number, class_name, section, roll_number, department, subject, phone, password)
+    ('admin', 'Administrator', None, None, None, None, None, None, '7382950164', 'Admin 0011'),
+    ('student', 'Moosa', '7354', '8th', 'Green', '19', None, None, None, 'student123'),
+    ('employee', 'Mehraj ud din mir', None, None, None, None, 'ICT', 'Computer', None, 'Mehraj123'),
+]
+
+# Demo catalogue (50 books as required): (id, title, category, author, code)
+SEED_BOOKS = [
+    (1, "To Kill a Mockingbird", "Fiction", "Harper Lee", "FIC001"),
+    (2, "1984", "Fiction", "George Orwell", "FIC002"),
+    (3, "Pride and Prejudice", "Romance", "Jane Austen", "ROM001"),
+    (4, "The Great Gatsby", "Fiction", "F. Scott Fitzgerald", "FIC003"),
+    (5, "Harry Potter and the Philosopher's Stone", "Fantasy", "J.K. Rowling", "FAN001"),
+    (6, "The Catcher in the Rye", "Fiction", "J.D. Salinger", "FIC004"),
+    (7, "Lord of the Flies", "Fiction", "William Golding", "FIC005"),
+    (8, "The Hobbit", "Fantasy", "J.R.R. Tolkien", "FAN002"),
+    (9, "Fahrenheit 451", "Science Fiction", "Ray Bradbury", "SCI001"),
+    (10, "Jane Eyre", "Romance", "Charlotte Brontë", "ROM002"),
+    (11, "Wuthering Heights", "Romance", "Emily Brontë", "ROM003"),
+    (12, "The Lord of the Rings", "Fantasy", "J.R.R. Tolkien", "FAN003"),
+    (13, "Animal Farm", "Fiction", "George Orwell", "FIC006"),
+    (14, "Brave New World", "Science Fiction", "Aldous Huxley", "SCI002"),
+    (15, "The Kite Runner", "Drama", "Khaled Hosseini", "DRA001"),
+    (16, "Life of Pi", "Adventure", "Yann Martel", "ADV001"),
+    (17, "The Book Thief", "Historical Fiction", "Markus Zusak", "HIS001"),
+    (18, "The Alchemist", "Philosophy", "Paulo Coelho", "PHI001"),
+    (19, "One Hundred Years of Solitude", "Magical Realism", "Gabriel García Márquez", "MAG001"),
+    (20, "The Picture of Dorian Gray", "Gothic", "Oscar Wilde", "GOT001"),
+    (21, "Dracula", "Horror", "Bram Stoker", "HOR001"),
+    (22, "Frankenstein", "Horror", "Mary Shelley", "HOR002"),
+    (23, "The Strange Case of Dr. Jekyll and Mr. Hyde", "Horror", "Robert Louis Stevenson", "HOR003"),
+    (24, "A Tale of Two Cities", "Historical Fiction", "Charles Dickens", "HIS002"),
+    (25, "Great Expectations", "Fiction", "Charles Dickens", "FIC007"),
+    (26, "Oliver Twist", "Fiction", "Charles Dickens", "FIC008"),
+    (27, "David Copperfield", "Fiction", "Charles Dickens", "FIC009"),
+    (28, "The Adventures of Tom Sawyer", "Adventure", "Mark Twain", "ADV002"),
+    (29, "Adventures of Huckleberry Finn", "Adventure", "Mark Twain", "ADV003"),
+    (30, "Moby Dick", "Adventure", "Herman Melville", "ADV004"),
+    (31, "The Odyssey", "Epic", "Homer", "EPI001"),
+    (32, "The Iliad", "Epic", "Homer", "EPI002"),
+    (33, "Romeo and Juliet", "Drama", "William Shakespeare", "DRA002"),
+    (34, "Hamlet", "Drama", "William Shakespeare", "DRA003"),
+    (35, "Macbeth", "Drama", "William Shakespeare", "DRA004"),
+    (36, "Othello", "Drama", "William Shakespeare", "DRA005"),
+    (37, "King Lear", "Drama", "William Shakespeare", "DRA006"),
+    (38, "A Midsummer Night's Dream", "Comedy", "William Shakespeare", "COM001"),
+    (39, "The Merchant of Venice", "Drama", "William Shakespeare", "DRA007"),
+    (40, "The Tempest", "Drama", "William Shakespeare", "DRA008"),
+    (41, "Don Quixote", "Adventure", "Miguel de Cervantes", "ADV005"),
+    (42, "War and Peace", "Historical Fiction", "Leo Tolstoy", "HIS003"),
+    (43, "Anna Karenina", "Romance", "Leo Tolstoy", "ROM004"),
+    (44, "Crime and Punishment", "Psychological Fiction", "Fyodor Dostoevsky", "PSY001"),
+    (45, "The Brothers Karamazov", "Philosophical Fiction", "Fyodor Dostoevsky", "PHI002"),
+    (46, "Les Misérables", "Historical Fiction", "Victor Hugo", "HIS004"),
+    (47, "The Hunchback of Notre-Dame", "Historical Fiction", "Victor Hugo", "HIS005"),
+    (48, "The Count of Monte Cristo", "Adventure", "Alexandre Dumas", "ADV006"),
+    (49, "The Three Musketeers", "Adventure", "Alexandre Dumas", "ADV007"),
+    (50, "Around the World in Eighty Days", "Adventure", "Jules Verne", "ADV008")
+]
+
+def seed_db(conn):
+    """Load the demo users, books and loans into an empty library in one transaction"""
+    has_data = conn.execute(
+        'SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM books)'
+    ).fetchone()[0]
+    if has_data:
+        return False
+    
+    def days_ago(days):
+        return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
     
-    # Create tables
-    conn.executescript('''
-        DROP TABLE IF EXISTS users;
-        DROP TABLE IF EXISTS books;
-        DROP TABLE IF EXISTS transactions;
+    hashes = hash_passwords([user[-1] for user in SEED_USERS])
+    with conn:
+        conn.executemany('''
+            INSERT INTO users (user_type, name, admission_number, class_name, section,
+                               roll_number, department, subject, phone, password)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [user[:-1] + (hashed,) for user, hashed in zip(SEED_USERS, hashes)])
         
-        CREATE TABLE users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_type TEXT NOT NULL,
-            name TEXT,
-            admission_number TEXT,
-            class_name TEXT,
-            section TEXT,
-            roll_number TEXT,
-            department TEXT,
-            subject TEXT,
-            phone TEXT,
-            password TEXT
-        );
+        conn.executemany('''
+            INSERT INTO books (id, title, category, author, code)
+            VALUES (?, ?, ?, ?, ?)
+        ''', SEED_BOOKS)
+        # One copy of each, barcoded with the book code; copy ids match book ids
+        conn.execute('INSERT INTO book_copies (id, book_id, barcode) SELECT id, id, code FROM books')
         
-        CREATE TABLE books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            category TEXT NOT NULL,
-            author TEXT NOT NULL,
-            code TEXT NOT NULL UNIQUE,
-            available INTEGER DEFAULT 1
-        );
+        student_id = conn.execute("SELECT id FROM users WHERE name = 'Moosa'").fetchone()['id']
+        employee_id = conn.execute("SELECT id FROM users WHERE name = 'Mehraj ud din mir'").fetchone()['id']
         
-        CREATE TABLE transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            book_id INTEGER NOT NULL,
-            issue_date TEXT NOT NULL,
-            return_date TEXT,
-            status TEXT DEFAULT 'issued',
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (book_id) REFERENCES books (id)
-        );
-    ''')
-    
-    # Insert test users
-    conn.execute('''
-        INSERT INTO users (user_type, phone, password, name) 
-        VALUES ('admin', '7382950164', 'Admin 0011', 'Administrator')
-    ''')
-    
-    conn.execute('''
-        INSERT INTO users (user_type, name, admission_number, class_name, section, roll_number, password) 
-        VALUES ('student', 'Moosa', '7354', '8th', 'Green', '19', 'student123')
-    ''')
-    
-    conn.execute('''
-        INSERT INTO users (user_type, name, department, subject, password) 
-        VALUES ('employee', 'Mehraj ud din mir', 'ICT', 'Computer', 'Mehraj123')
-    ''')
-    
-    # Insert books (50 books as required)
-    books_data = [
-        (1, "To Kill a Mockingbird", "Fiction", "Harper Lee", "FIC001"),
-        (2, "1984", "Fiction", "George Orwell", "FIC002"),
-        (3, "Pride and Prejudice", "Romance", "Jane Austen", "ROM001"),
-        (4, "The Great Gatsby", "Fiction", "F. Scott Fitzgerald", "FIC003"),
-        (5, "Harry Potter and the Philosopher's Stone", "Fantasy", "J.K. Rowling", "FAN001"),
-        (6, "The Catcher in the Rye", "Fiction", "J.D. Salinger", "FIC004"),
-        (7, "Lord of the Flies", "Fiction", "William Golding", "FIC005"),
-        (8, "The Hobbit", "Fantasy", "J.R.R. Tolkien", "FAN002"),
-        (9, "Fahrenheit 451", "Science Fiction", "Ray Bradbury", "SCI001"),
-        (10, "Jane Eyre", "Romance", "Charlotte Brontë", "ROM002"),
-        (11, "Wuthering Heights", "Romance", "Emily Brontë", "ROM003"),
-        (12, "The Lord of the Rings", "Fantasy", "J.R.R. Tolkien", "FAN003"),
-        (13, "Animal Farm", "Fiction", "George Orwell", "FIC006"),
-        (14, "Brave New World", "Science Fiction", "Aldous Huxley", "SCI002"),
-        (15, "The Kite Runner", "Drama", "Khaled Hosseini", "DRA001"),
-        (16, "Life of Pi", "Adventure", "Yann Martel", "ADV001"),
-        (17, "The Book Thief", "Historical Fiction", "Markus Zusak", "HIS001"),
-        (18, "The Alchemist", "Philosophy", "Paulo Coelho", "PHI001"),
-        (19, "One Hundred Years of Solitude", "Magical Realism", "Gabriel García Márquez", "MAG001"),
-        (20, "The Picture of Dorian Gray", "Gothic", "Oscar Wilde", "GOT001"),
-        (21, "Dracula", "Horror", "Bram Stoker", "HOR001"),
-        (22, "Frankenstein", "Horror", "Mary Shelley", "HOR002"),
-        (23, "The Strange Case of Dr. Jekyll and Mr. Hyde", "Horror", "Robert Louis Stevenson", "HOR003"),
-        (24, "A Tale of Two Cities", "Historical Fiction", "Charles Dickens", "HIS002"),
-        (25, "Great Expectations", "Fiction", "Charles Dickens", "FIC007"),
-        (26, "Oliver Twist", "Fiction", "Charles Dickens", "FIC008"),
-        (27, "David Copperfield", "Fiction", "Charles Dickens", "FIC009"),
-        (28, "The Adventures of Tom Sawyer", "Adventure", "Mark Twain", "ADV002"),
-        (29, "Adventures of Huckleberry Finn", "Adventure", "Mark Twain", "ADV003"),
-        (30, "Moby Dick", "Adventure", "Herman Melville", "ADV004"),
-        (31, "The Odyssey", "Epic", "Homer", "EPI001"),
-        (32, "The Iliad", "Epic", "Homer", "EPI002"),
-        (33, "Romeo and Juliet", "Drama", "William Shakespeare", "DRA002"),
-        (34, "Hamlet", "Drama", "William Shakespeare", "DRA003"),
-        (35, "Macbeth", "Drama", "William Shakespeare", "DRA004"),
-        (36, "Othello", "Drama", "William Shakespeare", "DRA005"),
-        (37, "King Lear", "Drama", "William Shakespeare", "DRA006"),
-        (38, "A Midsummer Night's Dream", "Comedy", "William Shakespeare", "COM001"),
-        (39, "The Merchant of Venice", "Drama", "William Shakespeare", "DRA007"),
-        (40, "The Tempest", "Drama", "William Shakespeare", "DRA008"),
-        (41, "Don Quixote", "Adventure", "Miguel de Cervantes", "ADV005"),
-        (42, "War and Peace", "Historical Fiction", "Leo Tolstoy", "HIS003"),
-        (43, "Anna Karenina", "Romance", "Leo Tolstoy", "ROM004"),
-        (44, "Crime and Punishment", "Psychological Fiction", "Fyodor Dostoevsky", "PSY001"),
-        (45, "The Brothers Karamazov", "Philosophical Fiction", "Fyodor Dostoevsky", "PHI002"),
-        (46, "Les Misérables", "Historical Fiction", "Victor Hugo", "HIS004"),
-        (47, "The Hunchback of Notre-Dame", "Historical Fiction", "Victor Hugo", "HIS005"),
-        (48, "The Count of Monte Cristo", "Adventure", "Alexandre Dumas", "ADV006"),
-        (49, "The Three Musketeers", "Adventure", "Alexandre Dumas", "ADV007"),
-        (50, "Around the World in Eighty Days", "Adventure", "Jules Verne", "ADV008")
-    ]
-    
-    for book in books_data:
-        conn.execute('''
-            INSERT INTO books (id, title, category, author, code, available) 
-            VALUES (?, ?, ?, ?, ?, 1)
-        ''', book)
-    
-    # Get user IDs
-    student_id = conn.execute("SELECT id FROM users WHERE name = 'Moosa'").fetchone()['id']
-    employee_id = conn.execute("SELECT id FROM users WHERE name = 'Mehraj ud din mir'").fetchone()['id']
-    
-    # Student transactions (last 3 books issued, first 2 returned, one overdue by 6 days)
-    # Issue last 3 books (48, 49, 50)
-    issue_date_overdue = (datetime.now() - timedelta(days=13)).strftime('%Y-%m-%d')  # 13 days ago (6 days overdue)
-    issue_date_recent = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d')   # 3 days ago
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, status)
-        VALUES (?, 48, ?, 'issued')
-    ''', (student_id, issue_date_overdue))
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, status)
-        VALUES (?, 49, ?, 'issued')
-    ''', (student_id, issue_date_recent))
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, status)
-        VALUES (?, 50, ?, 'issued')
-    ''', (student_id, issue_date_recent))
-    
-    # Mark these books as unavailable
-    conn.execute('UPDATE books SET available = 0 WHERE id IN (48, 49, 50)')
-    
-    # Return first 2 books (1, 2)
-    return_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, return_date, status)
-        VALUES (?, 1, ?, ?, 'returned')
-    ''', (student_id, (datetime.now() - timedelta(days=5)).strftime('%Y-%m-%d'), return_date))
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, return_date, status)
-        VALUES (?, 2, ?, ?, 'returned')
-    ''', (student_id, (datetime.now() - timedelta(days=8)).strftime('%Y-%m-%d'), return_date))
-    
-    # Employee transactions (first 3 books issued, last 3 returned)
-    # Issue first 3 books (1, 2, 3) - but 1,2 are available since student returned them
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, status)
-        VALUES (?, 1, ?, 'issued')
-    ''', (employee_id, issue_date_recent))
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, status)
-        VALUES (?, 2, ?, 'issued')
-    ''', (employee_id, issue_date_recent))
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, status)
-        VALUES (?, 3, ?, 'issued')
-    ''', (employee_id, issue_date_recent))
-    
-    # Mark books 1, 2, 3 as unavailable
-    conn.execute('UPDATE books SET available = 0 WHERE id IN (1, 2, 3)')
-    
-    # Return last 3 books (48, 49, 50) - but these are currently with student, so use different books
-    # Let's use books 4, 5, 6 for employee returns
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, return_date, status)
-        VALUES (?, 4, ?, ?, 'returned')
-    ''', (employee_id, (datetime.now() - timedelta(days=10)).strftime('%Y-%m-%d'), return_date))
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, return_date, status)
-        VALUES (?, 5, ?, ?, 'returned')
-    ''', (employee_id, (datetime.now() - timedelta(days=9)).strftime('%Y-%m-%d'), return_date))
-    
-    conn.execute('''
-        INSERT INTO transactions (user_id, book_id, issue_date, return_date, status)
-        VALUES (?, 6, ?, ?, 'returned')
-    ''', (employee_id, (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'), return_date))
-    
-    conn.commit()
-    conn.close()
+        # Student: books 48-50 issued (48 is 6 days overdue), books 1-2 returned.
+        # Employee: books 1-3 issued, books 4-6 returned.
+        return_date = days_ago(1)
+        conn.executemany('''
+            INSERT INTO transactions (user_id, book_id, copy_id, issue_date, return_date, status)
+            VALUES (?1, ?2, ?2, ?3, ?4, ?5)
+        ''', [
+            (student_id, 48, days_ago(13), None, 'issued'),
+            (student_id, 49, days_ago(3), None, 'issued'),
+            (student_id, 50, days_ago(3), None, 'issued'),
+            (student_id, 1, days_ago(5), return_date, 'returned'),
+            (student_id, 2, days_ago(8), return_date, 'returned'),
+            (employee_id, 1, days_ago(3), None, 'issued'),
+            (employee_id, 2, days_ago(3), None, 'issued'),
+            (employee_id, 3, days_ago(3), None, 'issued'),
+            (employee_id, 4, days_ago(10), return_date, 'returned'),
+            (employee_id, 5, days_ago(9), return_date, 'returned'),
+            (employee_id, 6, days_ago(7), return_date, 'returned'),
+        ])
+        
+        conn.execute("UPDATE book_copies SET status = 'on_loan' WHERE id IN (1, 2, 3, 48, 49, 50)")
+    generations.bump('books', 'transactions', 'users')
+    return True
+
+def init_db(seed=True):
+    """Bootstrap library.db: apply pending migrations and seed an empty library"""
+    conn = get_db()
+    migrate(conn)
+    if seed:
+        return seed_db(conn)
+    return False
+
+def verify_schema(conn):
+    """Fail fast when library.db has not been bootstrapped to the current schema"""
+    version = current_version(conn)
+    if version != LATEST_VERSION:
+        raise RuntimeError(
+            f'library.db is at schema version {version}, expected {LATEST_VERSION}. '
+            'Run "flask --app main init-db" before starting the server.'
+        )
@@ -0,0 +1,30 @@
+"""Overdue fines: computed in SQL, with the Python rule kept as the reference"""
+from datetime import datetime
+
+FINE_GRACE_DAYS = 7
+FINE_PER_DAY = 2
+
+def calculate_fine(issue_date_str):
+    """Calculate fine for overdue books (₹2/day after 7 days).
+
+    Reference implementation of the loan_fines view; verify_fines() checks the
+    two agree.
+    """
+    try:
+        issue_date = datetime.strptime(issue_date_str, '%Y-%m-%d')
+        days_diff = (datetime.now() - issue_date).days
+        if days_diff > FINE_GRACE_DAYS:
+            return (days_diff - FINE_GRACE_DAYS) * FINE_PER_DAY
+        return 0
+    except:
+        return 0
+
+def verify_fines(conn):
+    """Compare the SQL fines with calculate_fine(); returns mismatching (transaction_id, sql, python)"""
+    mismatches = []
+    for transaction_id, issue_date, fine in conn.execute(
+            'SELECT transaction_id, issue_date, fine FROM loan_fines'):
+        expected = calculate_fine(issue_date)
+        if fine != expected:
+            mismatches.append((transaction_id, fine, expected))
+    return mismatches
@@ -0,0 +1,55 @@
+"""Dashboard fragments shared by every user, rendered once per generation.
+
+The catalogue tables, the book and user pickers and the category list look the
+same to everyone who sees them, so their HTML is cached under the generations
+of the tables they show and spliced into the page; only the per-user sections
+(loans, fines, flashes, search results) are rendered on every request. For the
+same reason partials under templates/partials/ get only the data context:
+no session, request or g.
+"""
+import os
+
+from flask import current_app
+from markupsafe import Markup
+
+from cache import LRUCache
+from database import generations
+
+fragment_cache = LRUCache(maxsize=64, ttl=int(os.environ.get('FRAGMENT_CACHE_TTL', 300)))
+
+# Fragment name -> (partial template, tables whose generations key it)
+FRAGMENTS = {
+    'available_books_table': ('partials/available_books.html', ('books',)),
+    'books_table': ('partials/books_table.html', ('books',)),
+    'book_options': ('partials/book_options.html', ('books',)),
+    'category_options': ('partials/category_options.html', ('books',)),
+    'user_options': ('partials/user_options.html', ('users',)),
+}
+
+DASHBOARD_FRAGMENTS = {
+    'student': ('available_books_table',),
+    'employee': ('available_books_table',),
+    'admin': ('books_table', 'book_options', 'category_options', 'user_options'),
+}
+
+def render_fragment(name, context, versions):
+    template, tables = FRAGMENTS[name]
+    key = (name,) + tuple(versions[table] for table in tables)
+    return fragment_cache.get(key, lambda: Markup(current_app.jinja_env.get_template(template).render(context)))
+
+def with_fragments(user_type, build_context):
+    """build_context() with the role's shared fragments rendered into it.
+
+    Generations are read before the data is loaded, so a write landing in
+    between can only file fresh HTML under an already stale key.
+    """
+    versions = dict(zip(generations.names, generations.snapshot()))
+    context = build_context()
+    for name in DASHBOARD_FRAGMENTS[user_type]:
+        context[name] = render_fragment(name, context, versions)
+    return context
+
+def precompile_templates(app):
+    """Compile every template at startup so the first requests do not pay for parsing"""
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
@@ -0,0 +1,283 @@
+"""Background jobs: persisted schedules, claimed atomically, run on a bounded pool.
+
+Schedules live in scheduled_jobs, so they survive restarts and every runner
+sees the same ones. A runner claims a due job with one conditional UPDATE
+(idle -> queued, with a lease), so any number of runners (the `flask run-jobs`
+sidecar, or a thread in each web worker with JOB_RUNNER=thread) can poll the
+same database and each run still happens once. Claimed jobs go to a
+ThreadPoolExecutor of JOB_WORKERS threads; a runner claims no more than
+JOB_WORKERS + JOB_QUEUE at a time, which bounds its queue. Request handlers
+never run a job: "run now" only moves next_run.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from archive import archive_returned_loans, maintain_database
+from database import DATABASE, pool
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE = int(os.environ.get('JOB_QUEUE', 4))
+JOB_TICK = int(os.environ.get('JOB_TICK', 30))
+# A job still claimed after this long is assumed lost with its runner and may be claimed again
+JOB_LEASE = timedelta(hours=int(os.environ.get('JOB_LEASE_HOURS', 2)))
+REMINDER_SINK = os.environ.get('REMINDER_SINK', DATABASE + '-outbox.jsonl')
+
+DAY = 24 * 60 * 60
+
+def stamp(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def next_run(after, every_seconds, at=None):
+    """When a job runs next: every_seconds after `after`, or at the next 'HH:MM' on that grid"""
+    if at is None:
+        return after + timedelta(seconds=every_seconds)
+    hour, minute = map(int, at.split(':'))
+    candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    while candidate <= after:
+        candidate += timedelta(seconds=every_seconds)
+    return candidate
+
+def precompute_overdue(conn):
+    """Snapshot today's overdue loans and fines from the loan_fines view into overdue_loans"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM overdue_loans')
+        conn.execute('''
+            INSERT INTO overdue_loans (transaction_id, user_id, book_id, issue_date, days_out, fine, computed_on)
+            SELECT transaction_id, user_id, book_id, issue_date, days_out, fine, ?
+            FROM loan_fines WHERE fine > 0
+        ''', (date.today().isoformat(),))
+        loans, fines = conn.execute('SELECT COUNT(*), COALESCE(SUM(fine), 0) FROM overdue_loans').fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {'overdue_loans': loans, 'fines': fines}
+
+def reminder_message(name, loans):
+    lines = [f'Dear {name},', '', 'The following library books are overdue:']
+    lines += [f'  - {title} ({days_out} days, fine Rs. {fine})' for title, days_out, fine in loans]
+    lines += ['', f'Total fine: Rs. {sum(loan[2] for loan in loans)}. Please return them to the library.']
+    return '\n'.join(lines)
+
+def queue_reminders(conn, sink=None):
+    """Write one reminder per user with overdue loans to the outbox, then deliver the outbox"""
+    today = date.today().isoformat()
+    if conn.execute('SELECT 1 FROM overdue_loans WHERE computed_on = ? LIMIT 1', (today,)).fetchone() is None:
+        precompute_overdue(conn)
+    by_user = {}
+    for user_id, name, title, days_out, fine in conn.execute('''
+        SELECT o.user_id, COALESCE(u.name, u.admission_number, ''), b.title, o.days_out, o.fine
+        FROM overdue_loans o
+        JOIN users u ON u.id = o.user_id
+        JOIN books b ON b.id = o.book_id
+        ORDER BY o.user_id, o.days_out DESC
+    '''):
+        by_user.setdefault((user_id, name), []).append((title, days_out, fine))
+    with conn:
+        queued = conn.executemany('''
+            INSERT INTO reminder_outbox (user_id, day, loans, fine, message) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, day) DO NOTHING
+        ''', [(user_id, today, len(loans), sum(loan[2] for loan in loans), reminder_message(name, loans))
+              for (user_id, name), loans in by_user.items()]).rowcount
+    return {'queued': queued, 'delivered': deliver_reminders(conn, sink or REMINDER_SINK)}
+
+def deliver_reminders(conn, sink, batch_size=500):
+    """Append undelivered outbox rows to the JSONL sink and mark them delivered.
+
+    The file is synced before the rows are marked, so a crash in between
+    delivers a batch twice rather than losing it.
+    """
+    delivered = 0
+    columns = ('id', 'user_id', 'day', 'loans', 'fine', 'message')
+    while True:
+        rows = conn.execute(f'''
+            SELECT {', '.join(columns)} FROM reminder_outbox WHERE delivered_at IS NULL ORDER BY id LIMIT ?
+        ''', (batch_size,)).fetchall()
+        if not rows:
+            return delivered
+        with open(sink, 'a', encoding='utf-8') as out:
+            for row in rows:
+                out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+            out.flush()
+            os.fsync(out.fileno())
+        with conn:
+            conn.execute(f"UPDATE reminder_outbox SET delivered_at = ? WHERE id IN ({', '.join('?' * len(rows))})",
+                         [stamp(datetime.now())] + [row[0] for row in rows])
+        delivered += len(rows)
+
+def database_maintenance(vacuum):
+    def run(conn):
+        (size, free), (new_size, new_free) = maintain_database(conn, vacuum)
+        return {'bytes_before': size, 'free_before': free, 'bytes_after': new_size, 'free_after': new_free}
+    return run
+
+Job = namedtuple('Job', 'name run every_seconds at description')
+
+JOBS = {job.name: job for job in (
+    Job('overdue-fines', precompute_overdue, DAY, '01:00', 'Snapshot overdue loans and fines'),
+    Job('archive-loans', lambda conn: {'archived': archive_returned_loans(conn)}, DAY, '02:00',
+        'Move old returned loans to the archive'),
+    Job('analyze', database_maintenance(vacuum=False), DAY, '03:00', 'ANALYZE and checkpoint the WAL'),
+    Job('vacuum', database_maintenance(vacuum=True), 7 * DAY, '03:30', 'VACUUM the database file'),
+    Job('reminders', queue_reminders, DAY, '07:00', 'Queue and deliver overdue reminders'),
+)}
+
+def ensure_schedules(conn):
+    """Add a schedule row for every job in JOBS; existing rows keep their next run and history"""
+    moment = datetime.now()
+    with conn:
+        conn.executemany('''
+            INSERT INTO scheduled_jobs (name, every_seconds, at, next_run) VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET every_seconds = excluded.every_seconds, at = excluded.at
+        ''', [(job.name, job.every_seconds, job.at, stamp(next_run(moment, job.every_seconds, job.at)))
+              for job in JOBS.values()])
+
+def request_run(conn, name):
+    """Make a job due now; the next runner tick picks it up. Returns False for an unknown job."""
+    with conn:
+        return conn.execute('UPDATE scheduled_jobs SET next_run = ? WHERE name = ?',
+                            (stamp(datetime.now()), name)).rowcount == 1
+
+def job_status(conn):
+    """Schedules with their last run, queue depth, and the overdue and outbox summaries"""
+    jobs = conn.execute('''
+        SELECT name, every_seconds, at, next_run, state, runner, last_started, last_finished,
+               last_duration_ms, last_status, last_result, last_error, runs, failures
+        FROM scheduled_jobs ORDER BY next_run
+    ''').fetchall()
+    return {
+        'jobs': jobs,
+        'queued': sum(job['state'] == 'queued' for job in jobs),
+        'running': sum(job['state'] == 'running' for job in jobs),
+        'overdue': conn.execute('''
+            SELECT COUNT(*) as loans, COALESCE(SUM(fine), 0) as fines, MAX(computed_on) as computed_on
+            FROM overdue_loans
+        ''').fetchone(),
+        'outbox': conn.execute('''
+            SELECT COUNT(*) - COUNT(delivered_at) as pending, COUNT(delivered_at) as delivered FROM reminder_outbox
+        ''').fetchone(),
+        'runner': runner.stats() if runner else None,
+    }
+
+class JobRunner:
+    def __init__(self, workers=JOB_WORKERS, queue=JOB_QUEUE, tick=JOB_TICK):
+        self.workers = workers
+        self.capacity = workers + queue
+        self.tick = tick
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run_due(self):
+        """Claim due jobs up to capacity and hand them to the pool; returns the names claimed"""
+        conn = pool.acquire()
+        try:
+            moment = stamp(datetime.now())
+            lease = stamp(datetime.now() + JOB_LEASE)
+            due = [row[0] for row in conn.execute('''
+                SELECT name FROM scheduled_jobs
+                WHERE next_run <= ? AND (state = 'idle' OR lease_until < ?)
+                ORDER BY next_run
+            ''', (moment, moment))]
+            claimed = []
+            for name in due:
+                if name not in JOBS:
+                    continue
+                with self._lock:
+                    if self._in_flight >= self.capacity:
+                        break
+                with conn:
+                    won = conn.execute('''
+                        UPDATE scheduled_jobs SET state = 'queued', lease_until = ?, runner = ?
+                        WHERE name = ? AND next_run <= ? AND (state = 'idle' OR lease_until < ?)
+                        RETURNING name
+                    ''', (lease, self.name, name, moment, moment)).fetchone()
+                if won:
+                    with self._lock:
+                        self._in_flight += 1
+                    self.executor.submit(self._run, name)
+                    claimed.append(name)
+            return claimed
+        finally:
+            pool.release(conn)
+
+    def _run(self, name):
+        job = JOBS[name]
+        conn = pool.acquire()
+        try:
+            with conn:
+                conn.execute("UPDATE scheduled_jobs SET state = 'running', last_started = ? WHERE name = ?",
+                             (stamp(datetime.now()), name))
+            started = time.perf_counter()
+            try:
+                result, status, error = job.run(conn), 'ok', None
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                logger.exception('job %s failed', name)
+                result, status, error = None, 'failed', traceback.format_exc(limit=5)
+            duration_ms = round((time.perf_counter() - started) * 1000)
+            finished = datetime.now()
+            with conn:
+                conn.execute('''
+                    UPDATE scheduled_jobs SET state = 'idle', lease_until = NULL, runner = NULL, next_run = ?,
+                        last_finished = ?, last_duration_ms = ?, last_status = ?, last_result = ?, last_error = ?,
+                        runs = runs + 1, failures = failures + ?
+                    WHERE name = ?
+                ''', (stamp(next_run(finished, job.every_seconds, job.at)), stamp(finished), duration_ms, status,
+                      json.dumps(result) if result is not None else None, error, status != 'ok', name))
+            logger.info('job %s %s in %d ms: %s', name, status, duration_ms, result)
+        finally:
+            pool.release(conn)
+            with self._lock:
+                self._in_flight -= 1
+
+    def serve(self):
+        """Poll for due jobs every tick until stop()"""
+        conn = pool.acquire()
+        try:
+            ensure_schedules(conn)
+        finally:
+            pool.release(conn)
+        while True:
+            try:
+                self.run_due()
+            except Exception:
+                logger.exception('job runner tick failed')
+            if self._stop.wait(self.tick):
+                return
+
+    def start(self):
+        threading.Thread(target=self.serve, name='job-runner', daemon=True).start()
+        return self
+
+    def stop(self, wait=True):
+        self._stop.set()
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            return {'runner': self.name, 'workers': self.workers, 'capacity': self.capacity,
+                    'in_flight': self._in_flight}
+
+# The runner of this process, if it has one (the sidecar, or JOB_RUNNER=thread)
+runner = None
+
+def start_runner(**options):
+    global runner
+    if runner is None:
+        runner = JobRunner(**options).start()
+    return runner
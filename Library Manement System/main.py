@@ -1,30 +1,65 @@
+import io
 import os
+import secrets
 import logging
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from datetime import datetime, timedelta
-from database import init_db, get_db_connection
-from auth import authenticate_user, get_user_role
+import sqlite3
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, Response, stream_with_context
+from itertools import islice
+from database import (DATABASE, MAX_COPIES, add_copies as add_book_copies, barcode_in_use, init_app, init_db,
+                      verify_schema, get_db, get_read_db, write, pool, read_pool, writer, generations, catalogue_cache,
+                      search_books as search_catalogue)
+from migrations import MigrationError, check_query_plans
+from api import api
+from archive import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH, archive_cutoff, archive_returned_loans, maintain_database
+from auth import (authenticate_user, get_user_profile, hash_password, rehash_plaintext_passwords,
+                  user_profiles)
+from bulk import IMPORTERS, EXPORTERS, MAX_WEB_USER_IMPORT, detect_format, read_records
+from fines import verify_fines
+from fragments import fragment_cache, precompile_templates, with_fragments
+from jobs import JOB_WORKERS, JOBS, JobRunner, ensure_schedules, job_status, request_run, start_runner
+from circulation import (MAX_BATCH, OPEN_LOANS_FOR_BOOK, issue_book as issue_book_atomically, issue_books,
+                         return_loan, return_loans)
+from metrics import init_metrics
+from reports import circulation_stats, verify_rollups
+from sessions import init_sessions
+from suggest import suggest_index
+from repository import (ADMIN_PAGES, admin_dashboard, check_query_budgets, dashboard, decode_cursor,
+                        fetch_admin_page, hot_queries, user_dashboard)
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "library_management_secret_key_2024")
+init_app(app)
+init_metrics(app, {'read': read_pool, 'write': pool})
+session_store = init_sessions(app, DATABASE, generations)
+app.register_blueprint(api)
+precompile_templates(app)
 
-# Initialize database on startup
-with app.app_context():
-    init_db()
+schema_verified = False
 
-def calculate_fine(issue_date_str):
-    """Calculate fine for overdue books (₹2/day after 7 days)"""
-    try:
-        issue_date = datetime.strptime(issue_date_str, '%Y-%m-%d')
-        days_diff = (datetime.now() - issue_date).days
-        if days_diff > 7:
-            return (days_diff - 7) * 2
-        return 0
-    except:
-        return 0
+@app.before_request
+def check_schema():
+    """Verify the schema version once per worker; bootstrapping is done by `flask init-db`"""
+    global schema_verified
+    if not schema_verified:
+        verify_schema(get_read_db())
+        schema_verified = True
+        suggest_index.warm()
+        if os.environ.get('JOB_RUNNER') == 'thread':
+            start_runner()
+
+@app.before_request
+def check_session_user():
+    """Drop a session whose user is gone or changed role, using the cached profile"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return
+    profile = get_user_profile(user_id)
+    if profile is None or profile['user_type'] != session.get('user_type'):
+        session.clear()
 
 @app.route('/admin/register/student', methods=['POST'])
 def admin_register_student():
@@ -35,26 +70,31 @@ def admin_register_student():
     if not admission_number or not password:
         flash('Admission number and password are required.', 'error')
         return redirect(url_for('dashboard_admin'))
-    conn = get_db_connection()
-    try:
+    hashed = hash_password(password)
+    
+    def register(conn):
         # prevent duplicates on admission_number among students
         existing = conn.execute("""
             SELECT id FROM users 
             WHERE user_type = 'student' AND admission_number = ?
         """, (admission_number,)).fetchone()
         if existing:
-            flash('Student with this admission number already exists.', 'error')
-            return redirect(url_for('dashboard_admin'))
+            return False
         conn.execute("""
             INSERT INTO users (user_type, admission_number, password)
             VALUES ('student', ?, ?)
-        """, (admission_number, password))
+        """, (admission_number, hashed))
         conn.commit()
+        return True
+    
+    try:
+        if not write(register):
+            flash('Student with this admission number already exists.', 'error')
+            return redirect(url_for('dashboard_admin'))
+        generations.bump('users')
         flash('Student registered successfully.', 'success')
     except Exception as e:
         flash(f'Error registering student: {str(e)}', 'error')
-    finally:
-        conn.close()
     return redirect(url_for('dashboard_admin'))
 
 @app.route('/admin/register/employee', methods=['POST'])
@@ -67,26 +107,31 @@ def admin_register_employee():
     if not name or not department or not password:
         flash('Name, department and password are required.', 'error')
         return redirect(url_for('dashboard_admin'))
-    conn = get_db_connection()
-    try:
+    hashed = hash_password(password)
+    
+    def register(conn):
         # prevent duplicates for the same employee name+department combo
         existing = conn.execute("""
             SELECT id FROM users 
             WHERE user_type = 'employee' AND name = ? AND department = ?
         """, (name, department)).fetchone()
         if existing:
-            flash('Employee with this name and department already exists.', 'error')
-            return redirect(url_for('dashboard_admin'))
+            return False
         conn.execute("""
             INSERT INTO users (user_type, name, department, password)
             VALUES ('employee', ?, ?, ?)
-        """, (name, department, password))
+        """, (name, department, hashed))
         conn.commit()
+        return True
+    
+    try:
+        if not write(register):
+            flash('Employee with this name and department already exists.', 'error')
+            return redirect(url_for('dashboard_admin'))
+        generations.bump('users')
         flash('Employee registered successfully.', 'success')
     except Exception as e:
         flash(f'Error registering employee: {str(e)}', 'error')
-    finally:
-        conn.close()
     return redirect(url_for('dashboard_admin'))
 
 @app.route('/')
@@ -103,6 +148,7 @@ def login_page(user_type):
 @app.route('/authenticate', methods=['POST'])
 def authenticate():
     user_type = request.form.get('user_type')
+    nonce = session.get('auth_nonce')
     user = None
     
     if user_type == 'student':
@@ -112,7 +158,7 @@ def authenticate():
         user = authenticate_user('student', {
             'admission_number': admission_number,
             'password': password
-        })
+        }, nonce)
         
     elif user_type == 'employee':
         name = request.form.get('name')
@@ -123,7 +169,7 @@ def authenticate():
             'name': name,
             'department': department,
             'password': password
-        })
+        }, nonce)
         
     elif user_type == 'admin':
         phone = request.form.get('phone')
@@ -132,12 +178,13 @@ def authenticate():
         user = authenticate_user('admin', {
             'phone': phone,
             'password': password
-        })
+        }, nonce)
     
     if user:
         session['user_id'] = user['id']
         session['user_type'] = user_type
         session['user_name'] = (user.get('name') or user.get('admission_number', ''))
+        session['auth_nonce'] = nonce or secrets.token_urlsafe(16)
         return redirect(url_for(f'dashboard_{user_type}'))
     else:
         flash('Invalid credentials. Please try again.', 'error')
@@ -148,129 +195,66 @@ def dashboard_student():
     if 'user_id' not in session or session.get('user_type') != 'student':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    user_id = session['user_id']
-    
-    # Get issued books
-    issued_books = conn.execute('''
-        SELECT b.title, b.author, b.code, t.issue_date, t.id as transaction_id
-        FROM transactions t
-        JOIN books b ON t.book_id = b.id
-        WHERE t.user_id = ? AND t.status = 'issued'
-    ''', (user_id,)).fetchall()
-    
-    # Get returned books
-    returned_books = conn.execute('''
-        SELECT b.title, b.author, b.code, t.issue_date, t.return_date
-        FROM transactions t
-        JOIN books b ON t.book_id = b.id
-        WHERE t.user_id = ? AND t.status = 'returned'
-    ''', (user_id,)).fetchall()
-    
-    # Get available books
-    available_books = conn.execute('''
-        SELECT * FROM books WHERE available = 1
-        ORDER BY title
-    ''').fetchall()
-    
-    # Calculate total fine
-    total_fine = 0
-    for book in issued_books:
-        fine = calculate_fine(book['issue_date'])
-        total_fine += fine
-    
-    conn.close()
-    
-    return render_template('dashboard_student.html', 
-                         issued_books=issued_books,
-                         returned_books=returned_books,
-                         available_books=available_books,
-                         total_fine=total_fine,
-                         calculate_fine=calculate_fine)
+    conn = get_read_db()
+    full_history = request.args.get('history') == 'all'
+    return render_template('dashboard_student.html',
+                           **with_fragments('student', lambda: user_dashboard(conn, session['user_id'], full_history)))
 
 @app.route('/dashboard/employee')
 def dashboard_employee():
     if 'user_id' not in session or session.get('user_type') != 'employee':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    user_id = session['user_id']
-    
-    # Get issued books
-    issued_books = conn.execute('''
-        SELECT b.title, b.author, b.code, t.issue_date
-        FROM transactions t
-        JOIN books b ON t.book_id = b.id
-        WHERE t.user_id = ? AND t.status = 'issued'
-    ''', (user_id,)).fetchall()
-    
-    # Get returned books
-    returned_books = conn.execute('''
-        SELECT b.title, b.author, b.code, t.issue_date, t.return_date
-        FROM transactions t
-        JOIN books b ON t.book_id = b.id
-        WHERE t.user_id = ? AND t.status = 'returned'
-    ''', (user_id,)).fetchall()
-    
-    # Get available books
-    available_books = conn.execute('''
-        SELECT * FROM books WHERE available = 1
-        ORDER BY title
-    ''').fetchall()
-    
-    conn.close()
-    
-    return render_template('dashboard_employee.html', 
-                         issued_books=issued_books,
-                         returned_books=returned_books,
-                         available_books=available_books)
+    conn = get_read_db()
+    full_history = request.args.get('history') == 'all'
+    return render_template('dashboard_employee.html',
+                           **with_fragments('employee', lambda: user_dashboard(conn, session['user_id'], full_history)))
 
 @app.route('/dashboard/admin')
 def dashboard_admin():
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
-    
-    # Get all issued books
-    issued_books = conn.execute('''
-        SELECT b.title, b.author, b.code, t.issue_date, u.name, u.user_type, t.id as transaction_id
-        FROM transactions t
-        JOIN books b ON t.book_id = b.id
-        JOIN users u ON t.user_id = u.id
-        WHERE t.status = 'issued'
-        ORDER BY t.issue_date DESC
-    ''').fetchall()
-    
-    # Get all returned books
-    returned_books = conn.execute('''
-        SELECT b.title, b.author, b.code, t.issue_date, t.return_date, u.name, u.user_type
-        FROM transactions t
-        JOIN books b ON t.book_id = b.id
-        JOIN users u ON t.user_id = u.id
-        WHERE t.status = 'returned'
-        ORDER BY t.return_date DESC
-    ''').fetchall()
-    
-    # Get all books
-    all_books = conn.execute('''
-        SELECT * FROM books ORDER BY title
-    ''').fetchall()
-    
-    # Get users for book assignment
-    all_users = conn.execute('''
-        SELECT id, name, user_type, admission_number, department FROM users WHERE user_type != 'admin'
-        ORDER BY user_type, COALESCE(name, admission_number)
-    ''').fetchall()
-    
-    conn.close()
-    
-    return render_template('dashboard_admin.html', 
-                         issued_books=issued_books,
-                         returned_books=returned_books,
-                         all_books=all_books,
-                         all_users=all_users,
-                         calculate_fine=calculate_fine)
+    conn = get_read_db()
+    return render_template('dashboard_admin.html', **with_fragments('admin', lambda: admin_dashboard(conn)))
+
+@app.route('/admin/page/<name>')
+def admin_page(name):
+    if session.get('user_type') != 'admin':
+        abort(403)
+    if name not in ADMIN_PAGES:
+        abort(404)
+    
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = decode_cursor(request.args['cursor'])
+        if cursor is None or len(cursor) != len(ADMIN_PAGES[name][2]):
+            abort(400)
+    
+    rows, next_cursor = fetch_admin_page(get_read_db(), name, cursor, request.args.get('limit', type=int))
+    return jsonify(items=[dict(row) for row in rows], next=next_cursor)
+
+@app.route('/admin/stats')
+def admin_stats():
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    return render_template('admin_stats.html', **circulation_stats(get_read_db()))
+
+@app.route('/admin/jobs')
+def admin_jobs():
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    return render_template('admin_jobs.html', **job_status(get_read_db()))
+
+@app.route('/admin/jobs/<name>/run', methods=['POST'])
+def run_job(name):
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    if write(request_run, name):
+        flash(f'{name} will run on the next runner tick.', 'success')
+    else:
+        flash('No such job.', 'error')
+    return redirect(url_for('admin_jobs'))
 
 @app.route('/admin/add_book', methods=['POST'])
 def add_book():
@@ -281,19 +265,32 @@ def add_book():
     category = request.form.get('category')
     author = request.form.get('author')
     code = request.form.get('code')
+    copies = request.form.get('copies', 1, type=int)
+    if not 1 <= copies <= MAX_COPIES:
+        flash(f'Copies must be between 1 and {MAX_COPIES}.', 'error')
+        return redirect(url_for('dashboard_admin'))
+    
+    def insert_book(conn):
+        # Scanning a title's code should find that title, not another title's copy
+        if barcode_in_use(conn, code):
+            return False
+        with conn:
+            book_id = conn.execute('''
+                INSERT INTO books (title, category, author, code)
+                VALUES (?, ?, ?, ?)
+            ''', (title, category, author, code)).lastrowid
+            add_book_copies(conn, book_id, copies)
+        return True
     
-    conn = get_db_connection()
     try:
-        conn.execute('''
-            INSERT INTO books (title, category, author, code, available)
-            VALUES (?, ?, ?, ?, 1)
-        ''', (title, category, author, code))
-        conn.commit()
-        flash('Book added successfully!', 'success')
+        if write(insert_book):
+            generations.bump('books')
+            suggest_index.sync(get_read_db())
+            flash('Book added successfully!', 'success')
+        else:
+            flash(f"Code {code} is already the barcode of another book's copy.", 'error')
     except Exception as e:
         flash(f'Error adding book: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('dashboard_admin'))
 
@@ -302,24 +299,57 @@ def remove_book(book_id):
     if session.get('user_type') != 'admin':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
+    def delete_book(conn):
+        # Check if book is currently issued, in the same transaction as the delete
+        # (a SELECT alone would not open one)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            issued = conn.execute(OPEN_LOANS_FOR_BOOK, (book_id,)).fetchone()
+            if issued['count'] > 0:
+                conn.rollback()
+                return False
+            conn.execute('DELETE FROM book_copies WHERE book_id = ?', (book_id,))
+            conn.execute('DELETE FROM books WHERE id = ?', (book_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return True
+    
     try:
-        # Check if book is currently issued
-        issued = conn.execute('''
-            SELECT COUNT(*) as count FROM transactions 
-            WHERE book_id = ? AND status = 'issued'
-        ''', (book_id,)).fetchone()
-        
-        if issued['count'] > 0:
+        if not write(delete_book):
             flash('Cannot remove book - it is currently issued!', 'error')
         else:
-            conn.execute('DELETE FROM books WHERE id = ?', (book_id,))
-            conn.commit()
+            generations.bump('books')
+            suggest_index.sync(get_read_db())
             flash('Book removed successfully!', 'success')
     except Exception as e:
         flash(f'Error removing book: {str(e)}', 'error')
-    finally:
-        conn.close()
+    
+    return redirect(url_for('dashboard_admin'))
+
+@app.route('/admin/add_copies/<int:book_id>', methods=['POST'])
+def add_copies(book_id):
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    count = request.form.get('count', 1, type=int)
+    if not 1 <= count <= MAX_COPIES:
+        flash(f'Copies must be between 1 and {MAX_COPIES}.', 'error')
+        return redirect(url_for('dashboard_admin'))
+    
+    def shelve(conn):
+        with conn:
+            return add_book_copies(conn, book_id, count)
+    
+    try:
+        if write(shelve):
+            generations.bump('books')
+            flash(f'Added {count} copies.' if count > 1 else 'Added a copy.', 'success')
+        else:
+            flash('Book not found!', 'error')
+    except Exception as e:
+        flash(f'Error adding copies: {str(e)}', 'error')
     
     return redirect(url_for('dashboard_admin'))
 
@@ -331,27 +361,13 @@ def issue_book():
     book_id = request.form.get('book_id')
     user_id = request.form.get('user_id')
     
-    conn = get_db_connection()
     try:
-        # Check if book is available
-        book = conn.execute('SELECT available FROM books WHERE id = ?', (book_id,)).fetchone()
-        if not book or not book['available']:
-            flash('Book is not available!', 'error')
-        else:
-            # Issue the book
-            conn.execute('''
-                INSERT INTO transactions (user_id, book_id, issue_date, status)
-                VALUES (?, ?, ?, 'issued')
-            ''', (user_id, book_id, datetime.now().strftime('%Y-%m-%d')))
-            
-            # Mark book as unavailable
-            conn.execute('UPDATE books SET available = 0 WHERE id = ?', (book_id,))
-            conn.commit()
+        if write(issue_book_atomically, book_id, user_id):
             flash('Book issued successfully!', 'success')
+        else:
+            flash('Book is not available!', 'error')
     except Exception as e:
         flash(f'Error issuing book: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('dashboard_admin'))
 
@@ -360,152 +376,318 @@ def return_book(transaction_id):
     if session.get('user_type') != 'admin':
         return redirect(url_for('index'))
     
-    conn = get_db_connection()
     try:
-        # Get the transaction
-        transaction = conn.execute('''
-            SELECT book_id FROM transactions WHERE id = ? AND status = 'issued'
-        ''', (transaction_id,)).fetchone()
-        
-        if transaction:
-            # Mark as returned
-            conn.execute('''
-                UPDATE transactions 
-                SET status = 'returned', return_date = ?
-                WHERE id = ?
-            ''', (datetime.now().strftime('%Y-%m-%d'), transaction_id))
-            
-            # Mark book as available
-            conn.execute('UPDATE books SET available = 1 WHERE id = ?', (transaction['book_id'],))
-            conn.commit()
+        if write(return_loan, transaction_id):
             flash('Book returned successfully!', 'success')
         else:
             flash('Transaction not found!', 'error')
     except Exception as e:
         flash(f'Error returning book: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('dashboard_admin'))
 
+def batch_items(key):
+    """Read a list from the JSON body of a batch request, or abort with 400"""
+    payload = request.get_json(silent=True) or {}
+    items = payload.get(key)
+    if not isinstance(items, list) or not items:
+        abort(400, f'Expected a non-empty "{key}" list.')
+    if len(items) > MAX_BATCH:
+        abort(400, f'At most {MAX_BATCH} items per batch.')
+    return items
+
+@app.route('/admin/issue_batch', methods=['POST'])
+def issue_batch():
+    if session.get('user_type') != 'admin':
+        abort(403)
+    
+    loans = []
+    for item in batch_items('loans'):
+        if isinstance(item, dict):
+            loans.append((item.get('book_id'), item.get('user_id')))
+        elif isinstance(item, list) and len(item) == 2:
+            loans.append(tuple(item))
+        else:
+            loans.append((None, None))
+    
+    results = write(issue_books, loans)
+    issued = sum(result['ok'] for result in results)
+    return jsonify(results=results, issued=issued, failed=len(results) - issued)
+
+@app.route('/admin/return_batch', methods=['POST'])
+def return_batch():
+    if session.get('user_type') != 'admin':
+        abort(403)
+    
+    results = write(return_loans, batch_items('transaction_ids'))
+    returned = sum(result['ok'] for result in results)
+    return jsonify(results=results, returned=returned, failed=len(results) - returned)
+
 @app.route('/search')
 def search_books():
     query = request.args.get('q', '').strip()
     if not query:
         return redirect(request.referrer or url_for('index'))
     
-    conn = get_db_connection()
-    search_term = query.lower()
-    books = conn.execute('''
-        SELECT * FROM books 
-        WHERE LOWER(title) LIKE ? OR LOWER(author) LIKE ? OR LOWER(code) LIKE ?
-        ORDER BY title COLLATE NOCASE
-    ''', (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%')).fetchall()
-    no_results = len(books) == 0
+    conn = get_read_db()
+    books = search_catalogue(conn, query)
     
-    # Return to appropriate dashboard with search results and required context
+    # Return to appropriate dashboard with search results layered on top
     user_type = session.get('user_type', 'student')
-    if user_type == 'student':
-        user_id = session.get('user_id')
-        issued_books = conn.execute('''
-            SELECT b.title, b.author, b.code, t.issue_date, t.id as transaction_id
-            FROM transactions t
-            JOIN books b ON t.book_id = b.id
-            WHERE t.user_id = ? AND t.status = 'issued'
-        ''', (user_id,)).fetchall()
-        returned_books = conn.execute('''
-            SELECT b.title, b.author, b.code, t.issue_date, t.return_date
-            FROM transactions t
-            JOIN books b ON t.book_id = b.id
-            WHERE t.user_id = ? AND t.status = 'returned'
-        ''', (user_id,)).fetchall()
-        available_books = conn.execute('''
-            SELECT * FROM books WHERE available = 1
-            ORDER BY title
-        ''').fetchall()
-        total_fine = 0
-        for book in issued_books:
-            fine = calculate_fine(book['issue_date'])
-            total_fine += fine
-        conn.close()
-        return render_template('dashboard_student.html',
-            issued_books=issued_books,
-            returned_books=returned_books,
-            available_books=available_books,
-            total_fine=total_fine,
-            calculate_fine=calculate_fine,
-            search_results=books,
-            search_query=query,
-            search_no_results=no_results
-        )
-    elif user_type == 'employee':
-        user_id = session.get('user_id')
-        issued_books = conn.execute('''
-            SELECT b.title, b.author, b.code, t.issue_date
-            FROM transactions t
-            JOIN books b ON t.book_id = b.id
-            WHERE t.user_id = ? AND t.status = 'issued'
-        ''', (user_id,)).fetchall()
-        returned_books = conn.execute('''
-            SELECT b.title, b.author, b.code, t.issue_date, t.return_date
-            FROM transactions t
-            JOIN books b ON t.book_id = b.id
-            WHERE t.user_id = ? AND t.status = 'returned'
-        ''', (user_id,)).fetchall()
-        available_books = conn.execute('''
-            SELECT * FROM books WHERE available = 1
-            ORDER BY title
-        ''').fetchall()
-        conn.close()
-        return render_template('dashboard_employee.html',
-            issued_books=issued_books,
-            returned_books=returned_books,
-            available_books=available_books,
-            search_results=books,
-            search_query=query,
-            search_no_results=no_results
-        )
-    else:  # admin
-        issued_books = conn.execute('''
-            SELECT b.title, b.author, b.code, t.issue_date, u.name, u.user_type, t.id as transaction_id
-            FROM transactions t
-            JOIN books b ON t.book_id = b.id
-            JOIN users u ON t.user_id = u.id
-            WHERE t.status = 'issued'
-            ORDER BY t.issue_date DESC
-        ''').fetchall()
-        returned_books = conn.execute('''
-            SELECT b.title, b.author, b.code, t.issue_date, t.return_date, u.name, u.user_type
-            FROM transactions t
-            JOIN books b ON t.book_id = b.id
-            JOIN users u ON t.user_id = u.id
-            WHERE t.status = 'returned'
-            ORDER BY t.return_date DESC
-        ''').fetchall()
-        all_books = conn.execute('''
-            SELECT * FROM books ORDER BY title
-        ''').fetchall()
-        all_users = conn.execute('''
-            SELECT id, name, user_type, admission_number, department FROM users WHERE user_type != 'admin'
-            ORDER BY user_type, COALESCE(name, admission_number)
-        ''').fetchall()
-        conn.close()
-        return render_template('dashboard_admin.html',
-            issued_books=issued_books,
-            returned_books=returned_books,
-            all_books=all_books,
-            all_users=all_users,
-            calculate_fine=calculate_fine,
-                         search_results=books, 
-            search_query=query,
-            search_no_results=no_results
-        )
+    return render_template(f'dashboard_{user_type}.html',
+        search_results=books,
+        search_query=query,
+        search_no_results=len(books) == 0,
+        **with_fragments(user_type, lambda: dashboard(conn, user_type, session.get('user_id')))
+    )
+
+@app.route('/admin/import/<kind>', methods=['POST'])
+def bulk_import(kind):
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    if kind not in IMPORTERS:
+        abort(404)
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a CSV or JSONL file to import.', 'error')
+        return redirect(url_for('dashboard_admin'))
+    
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    records = read_records(stream, detect_format(upload.filename))
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    if kind == 'users':
+        # Every user is a KDF run; refuse a file that cannot be hashed within the request
+        # before importing any of it, rather than time out part way through
+        records = list(islice(records, MAX_WEB_USER_IMPORT + 1))
+        if len(records) > MAX_WEB_USER_IMPORT:
+            message = (f'More than {MAX_WEB_USER_IMPORT} users: nothing was imported. Run '
+                       f'"flask --app main import users FILE" on the server for large files.')
+            if wants_json:
+                return jsonify(error=message), 413
+            flash(message, 'error')
+            return redirect(url_for('dashboard_admin'))
+    # Not through the writer: an import commits per batch on its own connection, so
+    # issues and returns interleave with it instead of queueing behind the whole file
+    try:
+        report = IMPORTERS[kind](get_db(), records)
+    except sqlite3.IntegrityError as e:
+        # The importers reject constraint failures line by line, so this is a backstop:
+        # batches before the failing one are already committed
+        message = f'Import {kind} stopped part way: {e}'
+        if wants_json:
+            return jsonify(error=message), 409
+        flash(message, 'error')
+        return redirect(url_for('dashboard_admin'))
+    if wants_json:
+        return jsonify(report.as_dict())
+    
+    flash(f'Import {kind}: {report.summary()}', 'success' if report.accepted else 'error')
+    for line_number, reason in report.rejected[:5]:
+        flash(f'Line {line_number}: {reason}', 'error')
+    return redirect(url_for('dashboard_admin'))
+
+@app.route('/admin/export/<kind>.<fmt>')
+def bulk_export(kind, fmt):
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    if kind not in EXPORTERS or fmt not in ('csv', 'jsonl'):
+        abort(404)
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    lines = EXPORTERS[kind](get_read_db(), fmt)
+    return Response(stream_with_context(lines), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+@app.route('/admin/revoke_sessions', methods=['POST'])
+def revoke_sessions():
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    
+    user_id = request.form.get('user_id', type=int)
+    if request.form.get('scope') == 'all':
+        session_store.revoke_all()
+        flash('Everyone has been logged out.', 'success')
+        return redirect(url_for('index'))
+    if user_id is None:
+        flash('Choose a user to log out.', 'error')
+    else:
+        session_store.revoke_user(user_id)
+        flash('User logged out of every device.', 'success')
+    return redirect(url_for('dashboard_admin'))
+
+@app.route('/admin/pool_stats')
+def pool_stats():
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    return {'read': read_pool.stats(), 'write': pool.stats(), 'writer': writer.stats()}
+
+@app.cli.command('init-db')
+@click.option('--seed/--no-seed', default=True, help='Load the demo library if the database is empty.')
+def init_db_command(seed):
+    """Create or upgrade library.db without touching existing data"""
+    try:
+        seeded = init_db(seed=seed)
+    except MigrationError as e:
+        print(e)
+        raise SystemExit(1)
+    if seeded:
+        print('Seeded the demo library.')
+    ensure_schedules(get_db())
+    print('Database is ready.')
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Run the jobs that are due, wait for them and exit (for cron).')
+@click.option('--now', 'run_now', multiple=True, type=click.Choice(sorted(JOBS)), help='Make this job due first.')
+@click.option('--workers', default=JOB_WORKERS, show_default=True, help='Jobs run at the same time.')
+def run_jobs_command(once, run_now, workers):
+    """Run scheduled background jobs: overdue snapshot, reminders and database maintenance"""
+    conn = get_db()
+    ensure_schedules(conn)
+    for name in run_now:
+        request_run(conn, name)
+    runner = JobRunner(workers=workers)
+    if once:
+        claimed = runner.run_due()
+        runner.stop()
+        for job in job_status(conn)['jobs']:
+            if job['name'] in claimed:
+                print(f"{job['name']}: {job['last_status']} in {job['last_duration_ms']} ms {job['last_result'] or ''}")
+        if not claimed:
+            print('No jobs due.')
+        return
+    print(f'Running jobs with {workers} worker(s); Ctrl-C to stop.')
+    try:
+        runner.serve()
+    except KeyboardInterrupt:
+        runner.stop()
+
+@app.cli.command('rehash-passwords')
+def rehash_passwords_command():
+    """Hash any passwords still stored in plaintext without waiting for their next login"""
+    print(f'Hashed {rehash_plaintext_passwords(get_db())} plaintext password(s).')
+
+@app.cli.command('revoke-sessions')
+@click.option('--user', 'user_id', type=int, help='Only log out this user id.')
+def revoke_sessions_command(user_id):
+    """Log one user, or everyone, out of every browser"""
+    if user_id is None:
+        session_store.revoke_all()
+        print('Revoked every session.')
+    else:
+        session_store.revoke_user(user_id)
+        print(f'Revoked every session of user {user_id}.')
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per INSERT transaction.')
+def import_command(kind, path, batch_size):
+    """Bulk import books or users from a CSV or JSONL file"""
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        report = IMPORTERS[kind](get_db(), read_records(stream, detect_format(path)), batch_size)
+    print(report.summary())
+    for line_number, reason in report.rejected:
+        print(f'  line {line_number}: {reason}')
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORTERS)))
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+def export_command(kind, output, fmt):
+    """Stream books or users to a CSV or JSONL file (stdout by default)"""
+    for line in EXPORTERS[kind](get_db(), fmt):
+        output.write(line)
+
+@app.cli.command('verify-fines')
+def verify_fines_command():
+    """Check the SQL fines in loan_fines against the Python calculate_fine()"""
+    mismatches = verify_fines(get_db())
+    for transaction_id, sql_fine, python_fine in mismatches:
+        print(f'loan {transaction_id}: SQL says {sql_fine}, calculate_fine says {python_fine}')
+    if mismatches:
+        raise SystemExit(1)
+    print('SQL fines match calculate_fine() for every open loan.')
+
+@app.cli.command('archive-loans')
+@click.option('--older-than', 'older_than_days', default=ARCHIVE_AFTER_DAYS, show_default=True,
+              help='Archive loans returned more than this many days ago.')
+@click.option('--batch-size', default=ARCHIVE_BATCH, show_default=True, help='Loans moved per transaction.')
+@click.option('--vacuum/--no-vacuum', default=False, help='VACUUM afterwards to shrink the file.')
+def archive_loans_command(older_than_days, batch_size, vacuum):
+    """Move loans returned before the cutoff out of the hot transactions table"""
+    moved = archive_returned_loans(get_db(), older_than_days, batch_size)
+    print(f'Archived {moved} loan(s) returned before {archive_cutoff(older_than_days)}.')
+    if moved or vacuum:
+        maintain_db(vacuum)
+
+@app.cli.command('maintain-db')
+@click.option('--vacuum/--no-vacuum', default=False, help='Also VACUUM (rewrites the file; blocks writers).')
+def maintain_db_command(vacuum):
+    """Refresh query planner statistics and checkpoint the WAL"""
+    maintain_db(vacuum)
+
+def maintain_db(vacuum):
+    (size, free), (new_size, new_free) = maintain_database(get_db(), vacuum)
+    print(f'Analyzed{" and vacuumed" if vacuum else ""}: {size / 1048576:.1f} MiB ({free / 1048576:.1f} free) '
+          f'-> {new_size / 1048576:.1f} MiB ({new_free / 1048576:.1f} free).')
+
+@app.cli.command('verify-circulation-stats')
+def verify_circulation_stats_command():
+    """Check every circulation rollup against a recount of the event log"""
+    mismatches = verify_rollups(get_db())
+    for table, differing in mismatches:
+        print(f'{table}: {differing} row(s) differ from the event log')
+    if mismatches:
+        raise SystemExit(1)
+    print('Circulation rollups match the event log.')
+
+@app.cli.command('check-query-budgets')
+def check_query_budgets_command():
+    """Fail if a dashboard or search view runs more SQL statements than its budget"""
+    failures = 0
+    for name, count, budget in check_query_budgets(get_db()):
+        ok = count <= budget
+        failures += not ok
+        print(f'{name}: {count} queries (budget {budget}) {"ok" if ok else "OVER BUDGET"}')
+    if failures:
+        raise SystemExit(1)
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any hot query's EXPLAIN QUERY PLAN regresses to a scan"""
+    conn = get_db()
+    failures = check_query_plans(conn, hot_queries(conn))
+    for name, detail, problem in failures:
+        print(f'{name}: {problem} ({detail})')
+    if failures:
+        raise SystemExit(1)
+    print('All hot queries use an index.')
+
+@app.route('/admin/cache_stats')
+def cache_stats():
+    if session.get('user_type') != 'admin':
+        return redirect(url_for('index'))
+    return {
+        'catalogue': catalogue_cache.stats(),
+        'fragments': fragment_cache.stats(),
+        'sessions': session_store.stats(),
+        'suggest': suggest_index.stats(),
+        'user_profiles': user_profiles.stats(),
+        'generations': dict(zip(generations.names, generations.snapshot())),
+    }
 
 @app.route('/logout')
 def logout():
+    # Keep the login nonce so a quick re-login from this browser hits the verification cache
+    nonce = session.get('auth_nonce')
     session.clear()
+    if nonce:
+        session['auth_nonce'] = nonce
     flash('Logged out successfully!', 'success')
     return redirect(url_for('index'))
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)                                                              
\ No newline at end of file
@@ -0,0 +1,292 @@
+"""Opt-in instrumentation: request, SQL statement and template timings as Prometheus metrics.
+
+Enabled with LIBRARY_METRICS=1. When it is off nothing is registered: pooled
+connections are plain sqlite3 connections and no request hooks run. Metrics
+are kept per worker process.
+"""
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, before_render_template, g, request, session, template_rendered
+
+logger = logging.getLogger('library.metrics')
+
+ENABLED = os.environ.get('LIBRARY_METRICS', '0') == '1'
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_MS', 100)) / 1000
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 1)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (plus +Inf), then the running sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series = [(values, list(counts), total) for values, (counts, total) in self._series.items()]
+        for values, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = format_labels(self.labels + ('le',), values + (bound,))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labels, values)
+            yield f'{self.name}_sum{labels} {total:.6f}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, total in series:
+            yield f'{self.name}{format_labels(self.labels, values)} {total}'
+
+request_seconds = Histogram('library_http_request_seconds', 'Time to build a response, by endpoint.',
+                            ('endpoint', 'method', 'status'), REQUEST_BUCKETS)
+statement_seconds = Histogram('library_sql_statement_seconds', 'SQLite statement execution time, including fetches.',
+                              ('statement',), QUERY_BUCKETS)
+statement_rows = Counter('library_sql_rows_total', 'Rows returned or changed, by statement.', ('statement',))
+slow_statements = Counter('library_sql_slow_statements_total', 'Statements slower than SLOW_QUERY_MS.', ('statement',))
+render_seconds = Histogram('library_template_render_seconds', 'Jinja template render time.',
+                           ('template',), REQUEST_BUCKETS)
+METRICS = (request_seconds, statement_seconds, statement_rows, slow_statements, render_seconds)
+
+# Gauges sampled at scrape time: name -> (help, sample function); see add_gauge
+GAUGES = {}
+
+def normalize_sql(sql):
+    """One label per statement shape: collapse whitespace and variable-length lists"""
+    sql = ' '.join(sql.split())
+    sql = re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', sql)
+    sql = re.sub(r'(\([^()]*\))(?:\s*,\s*\1)+', r'\1, ...', sql)
+    return sql
+
+def record_statement(sql, elapsed, rows):
+    statement = (normalize_sql(sql),)
+    statement_seconds.observe(statement, elapsed)
+    statement_rows.inc(statement, rows)
+    if elapsed >= SLOW_QUERY_SECONDS:
+        slow_statements.inc(statement)
+        logger.warning('slow query: %.1f ms, %d rows: %s', elapsed * 1000, rows, statement[0])
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times a statement from execute() until its rows are exhausted or the cursor is dropped"""
+
+    _sql = None
+
+    def _finish(self):
+        if self._sql is not None:
+            rows = self._rows if self._rows else max(self.rowcount, 0)
+            record_statement(self._sql, self._elapsed, rows)
+            self._sql = None
+
+    def _start(self, sql):
+        self._finish()
+        self._sql = sql
+        self._rows = 0
+        self._elapsed = 0.0
+
+    def execute(self, sql, parameters=()):
+        self._start(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._elapsed += time.perf_counter() - started
+            self._finish()
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._elapsed += time.perf_counter() - started
+            self._finish()
+            raise
+        self._elapsed += time.perf_counter() - started
+        self._rows += 1
+        return row
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - started
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - started
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:  # interpreter shutdown
+            pass
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements all go through InstrumentedCursor"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            record_statement('-- executescript', time.perf_counter() - started, 0)
+
+_render_starts = threading.local()
+
+def start_request():
+    g.metrics_started = time.perf_counter()
+
+def finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        request_seconds.observe((endpoint, request.method, str(response.status_code)),
+                                time.perf_counter() - started)
+    return response
+
+def start_render(sender, template, context, **extra):
+    stack = getattr(_render_starts, 'stack', None)
+    if stack is None:
+        stack = _render_starts.stack = []
+    stack.append(time.perf_counter())
+
+def finish_render(sender, template, context, **extra):
+    stack = getattr(_render_starts, 'stack', None)
+    if stack:
+        render_seconds.observe((template.name or 'string',), time.perf_counter() - stack.pop())
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, (help, sample) in GAUGES.items():
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} gauge')
+        for label_names, label_values, value in sample():
+            lines.append(f'{name}{format_labels(label_names, label_values)} {value}')
+    return '\n'.join(lines) + '\n'
+
+def metrics_endpoint():
+    """Metrics for a scraper sending METRICS_TOKEN as a bearer token, or an admin session.
+
+    Statement shapes and per-route traffic are not public, so without a token
+    only admins see them.
+    """
+    token = request.headers.get('Authorization', '')
+    scraper = bool(METRICS_TOKEN) and secrets.compare_digest(token, f'Bearer {METRICS_TOKEN}')
+    if not scraper and session.get('user_type') != 'admin':
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def add_gauge(name, help, sample):
+    """Register a gauge; sample() yields (label names, label values, value) tuples"""
+    GAUGES[name] = (help, sample)
+
+def init_metrics(app, pools):
+    """Install the hooks and /metrics when LIBRARY_METRICS=1; otherwise do nothing.
+
+    pools maps a label ('read', 'write') to each connection pool to instrument.
+    """
+    if not ENABLED:
+        return False
+    for pool in pools.values():
+        pool.factory = InstrumentedConnection
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+
+    def pool_sample():
+        samples = []
+        for name, pool in pools.items():
+            stats = pool.stats()
+            samples += [(('pool', 'state'), (name, state), stats[state]) for state in ('open', 'idle')]
+        return samples
+
+    add_gauge('library_db_pool_connections', 'Pooled SQLite connections by pool and state.', pool_sample)
+    return True
@@ -0,0 +1,507 @@
+"""Versioned schema migrations, tracked with PRAGMA user_version"""
+import sqlite3
+
+# Each migration is (version, description, script). Scripts must be safe to run
+# against a library.db created by the old DROP-and-recreate init_db().
+MIGRATIONS = [
+    (1, 'initial schema', '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_type TEXT NOT NULL,
+            name TEXT,
+            admission_number TEXT,
+            class_name TEXT,
+            section TEXT,
+            roll_number TEXT,
+            department TEXT,
+            subject TEXT,
+            phone TEXT,
+            password TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            category TEXT NOT NULL,
+            author TEXT NOT NULL,
+            code TEXT NOT NULL UNIQUE,
+            available INTEGER DEFAULT 1
+        );
+
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            issue_date TEXT NOT NULL,
+            return_date TEXT,
+            status TEXT DEFAULT 'issued',
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (book_id) REFERENCES books (id)
+        );
+    '''),
+    (2, 'full-text search index', '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, category, code,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author, category, code)
+            VALUES (new.id, new.title, new.author, new.category, new.code);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, category, code)
+            VALUES ('delete', old.id, old.title, old.author, old.category, old.code);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, category, code ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, category, code)
+            VALUES ('delete', old.id, old.title, old.author, old.category, old.code);
+            INSERT INTO books_fts (rowid, title, author, category, code)
+            VALUES (new.id, new.title, new.author, new.category, new.code);
+        END;
+
+        INSERT INTO books_fts (books_fts) VALUES ('rebuild');
+    '''),
+    (3, 'secondary indexes for dashboards, circulation and login', '''
+        -- Per-user dashboards: WHERE t.user_id = ? AND t.status = ?
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_status
+            ON transactions (user_id, status);
+
+        -- Open loans per book (remove_book); made UNIQUE by migration 4
+        CREATE INDEX IF NOT EXISTS idx_transactions_open_book
+            ON transactions (book_id) WHERE status = 'issued';
+
+        -- Admin issued/returned pages seek on (date, id)
+        CREATE INDEX IF NOT EXISTS idx_transactions_issued_date
+            ON transactions (issue_date, id) WHERE status = 'issued';
+        CREATE INDEX IF NOT EXISTS idx_transactions_returned_date
+            ON transactions (return_date, id) WHERE status = 'returned';
+
+        -- Catalogue listings ordered by title
+        CREATE INDEX IF NOT EXISTS idx_books_title
+            ON books (title, id);
+        CREATE INDEX IF NOT EXISTS idx_books_available_title
+            ON books (title, id) WHERE available = 1;
+
+        -- Login lookups in authenticate_user
+        CREATE INDEX IF NOT EXISTS idx_users_student_login
+            ON users (admission_number) WHERE user_type = 'student';
+        CREATE INDEX IF NOT EXISTS idx_users_employee_login
+            ON users (name, department) WHERE user_type = 'employee';
+        CREATE INDEX IF NOT EXISTS idx_users_admin_login
+            ON users (phone) WHERE user_type = 'admin';
+
+        -- Admin user picker ordering
+        CREATE INDEX IF NOT EXISTS idx_users_listing
+            ON users (user_type, COALESCE(name, admission_number, ''), id);
+
+        ANALYZE;
+    '''),
+    (4, 'at most one open loan per book', '''
+        -- migrate() refuses to run this if the old check-then-act issue path
+        -- ever double-issued a book (see duplicate_open_loans)
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_one_open_loan
+            ON transactions (book_id) WHERE status = 'issued';
+        DROP INDEX IF EXISTS idx_transactions_open_book;
+    '''),
+    (5, 'fines computed in SQL', '''
+        -- Open loans with days out and fine: 2 per day after a 7 day grace
+        -- period (fines.FINE_PER_DAY / FINE_GRACE_DAYS). Must match
+        -- fines.calculate_fine(); see fines.verify_fines().
+        CREATE VIEW IF NOT EXISTS loan_fines AS
+        SELECT id AS transaction_id, user_id, book_id, issue_date,
+               COALESCE(CAST(julianday('now', 'localtime') - julianday(issue_date) AS INTEGER), 0) AS days_out,
+               COALESCE(MAX(0, CAST(julianday('now', 'localtime') - julianday(issue_date) AS INTEGER) - 7) * 2, 0) AS fine
+        FROM transactions
+        WHERE status = 'issued';
+    '''),
+    (6, 'multiple copies per title', '''
+        -- books becomes the title table; each physical copy is a book_copies
+        -- row with its own barcode. Triggers keep copies_total,
+        -- copies_available and the available flag (copies_available > 0) on
+        -- the title, so listings never touch book_copies.
+        ALTER TABLE books ADD COLUMN copies_total INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE books ADD COLUMN copies_available INTEGER NOT NULL DEFAULT 0;
+
+        CREATE TABLE IF NOT EXISTS book_copies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            barcode TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'available',
+            FOREIGN KEY (book_id) REFERENCES books (id)
+        );
+
+        -- Shelf copies of a title (issue) and all copies of a title (remove)
+        CREATE INDEX IF NOT EXISTS idx_book_copies_book
+            ON book_copies (book_id, status);
+
+        ALTER TABLE transactions ADD COLUMN copy_id INTEGER REFERENCES book_copies (id);
+
+        -- Every existing book is one copy, barcoded with its code and sharing its
+        -- id, so existing loans map onto copies without a lookup
+        INSERT INTO book_copies (id, book_id, barcode, status)
+        SELECT b.id, b.id, b.code,
+               CASE WHEN EXISTS (SELECT 1 FROM transactions t WHERE t.book_id = b.id AND t.status = 'issued')
+                    THEN 'on_loan' ELSE 'available' END
+        FROM books b;
+        UPDATE transactions SET copy_id = book_id;
+        UPDATE books SET copies_total = 1,
+                         copies_available = (SELECT c.status = 'available' FROM book_copies c WHERE c.id = books.id),
+                         available = (SELECT c.status = 'available' FROM book_copies c WHERE c.id = books.id);
+
+        CREATE TRIGGER IF NOT EXISTS book_copies_insert AFTER INSERT ON book_copies BEGIN
+            UPDATE books SET copies_total = copies_total + 1,
+                             copies_available = copies_available + (new.status = 'available'),
+                             available = copies_available + (new.status = 'available') > 0
+            WHERE id = new.book_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS book_copies_delete AFTER DELETE ON book_copies BEGIN
+            UPDATE books SET copies_total = copies_total - 1,
+                             copies_available = copies_available - (old.status = 'available'),
+                             available = copies_available - (old.status = 'available') > 0
+            WHERE id = old.book_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS book_copies_status AFTER UPDATE OF status ON book_copies
+        WHEN old.status != new.status BEGIN
+            UPDATE books SET copies_available = copies_available + (new.status = 'available') - (old.status = 'available'),
+                             available = copies_available + (new.status = 'available') - (old.status = 'available') > 0
+            WHERE id = new.book_id;
+        END;
+
+        -- At most one open loan per copy; a title may now be out several times
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_one_open_loan_per_copy
+            ON transactions (copy_id) WHERE status = 'issued';
+        DROP INDEX IF EXISTS idx_transactions_one_open_loan;
+        CREATE INDEX IF NOT EXISTS idx_transactions_open_book
+            ON transactions (book_id) WHERE status = 'issued';
+    '''),
+    (7, 'circulation event log and rollups', '''
+        -- Append-only: one row per issue, return, copy added or copy removed,
+        -- written by triggers in the same transaction as the change. `day` is
+        -- the business date the event counts towards.
+        CREATE TABLE IF NOT EXISTS circulation_events (
+            id INTEGER PRIMARY KEY,
+            event TEXT NOT NULL,
+            day TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            copy_id INTEGER,
+            user_id INTEGER,
+            transaction_id INTEGER,
+            category TEXT NOT NULL,
+            loan_days INTEGER,
+            recorded_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+        );
+
+        -- Rollups kept by a trigger on circulation_events; reports read only these
+        CREATE TABLE IF NOT EXISTS daily_circulation (
+            day TEXT PRIMARY KEY,
+            issues INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            loan_days INTEGER NOT NULL DEFAULT 0,
+            copies_added INTEGER NOT NULL DEFAULT 0,
+            copies_removed INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS category_circulation (
+            month TEXT NOT NULL,
+            category TEXT NOT NULL,
+            issues INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            loan_days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, category)
+        ) WITHOUT ROWID;
+
+        -- All-time per category, so totals do not grow with years of history
+        CREATE TABLE IF NOT EXISTS category_totals (
+            category TEXT PRIMARY KEY,
+            issues INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            loan_days INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS user_circulation (
+            user_id INTEGER PRIMARY KEY,
+            issues INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            loan_days INTEGER NOT NULL DEFAULT 0,
+            last_day TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS title_circulation (
+            book_id INTEGER PRIMARY KEY,
+            issues INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            loan_days INTEGER NOT NULL DEFAULT 0,
+            last_day TEXT
+        );
+
+        -- Busiest titles and borrowers without sorting the rollup
+        CREATE INDEX IF NOT EXISTS idx_title_circulation_issues
+            ON title_circulation (issues DESC, book_id);
+        CREATE INDEX IF NOT EXISTS idx_user_circulation_issues
+            ON user_circulation (issues DESC, user_id);
+
+        -- Backfill from the loans on record; copies that already exist have no
+        -- history, so they are not logged as added
+        INSERT INTO circulation_events (event, day, book_id, copy_id, user_id, transaction_id, category, recorded_at)
+        SELECT 'issue', t.issue_date, t.book_id, t.copy_id, t.user_id, t.id, COALESCE(b.category, 'Unknown'), t.issue_date
+        FROM transactions t LEFT JOIN books b ON b.id = t.book_id
+        ORDER BY t.id;
+        INSERT INTO circulation_events (event, day, book_id, copy_id, user_id, transaction_id, category,
+                                        loan_days, recorded_at)
+        SELECT 'return', COALESCE(t.return_date, t.issue_date), t.book_id, t.copy_id, t.user_id, t.id,
+               COALESCE(b.category, 'Unknown'),
+               CAST(julianday(COALESCE(t.return_date, t.issue_date)) - julianday(t.issue_date) AS INTEGER),
+               COALESCE(t.return_date, t.issue_date)
+        FROM transactions t LEFT JOIN books b ON b.id = t.book_id
+        WHERE t.status = 'returned'
+        ORDER BY t.return_date, t.id;
+
+        INSERT INTO daily_circulation (day, issues, returns, loan_days, copies_added, copies_removed)
+        SELECT day, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0)), 0, 0
+        FROM circulation_events GROUP BY day;
+        INSERT INTO category_circulation (month, category, issues, returns, loan_days)
+        SELECT substr(day, 1, 7), category, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0))
+        FROM circulation_events GROUP BY substr(day, 1, 7), category;
+        INSERT INTO category_totals (category, issues, returns, loan_days)
+        SELECT category, SUM(issues), SUM(returns), SUM(loan_days) FROM category_circulation GROUP BY category;
+        INSERT INTO user_circulation (user_id, issues, returns, loan_days, last_day)
+        SELECT user_id, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0)), MAX(day)
+        FROM circulation_events GROUP BY user_id;
+        INSERT INTO title_circulation (book_id, issues, returns, loan_days, last_day)
+        SELECT book_id, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0)), MAX(day)
+        FROM circulation_events GROUP BY book_id;
+
+        CREATE TRIGGER IF NOT EXISTS circulation_events_append_only_update BEFORE UPDATE ON circulation_events BEGIN
+            SELECT RAISE(ABORT, 'circulation_events is append-only');
+        END;
+        CREATE TRIGGER IF NOT EXISTS circulation_events_append_only_delete BEFORE DELETE ON circulation_events BEGIN
+            SELECT RAISE(ABORT, 'circulation_events is append-only');
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS circulation_events_rollup AFTER INSERT ON circulation_events BEGIN
+            INSERT INTO daily_circulation (day, issues, returns, loan_days, copies_added, copies_removed)
+            VALUES (new.day, new.event = 'issue', new.event = 'return', COALESCE(new.loan_days, 0),
+                    new.event = 'add', new.event = 'remove')
+            ON CONFLICT (day) DO UPDATE SET
+                issues = issues + excluded.issues, returns = returns + excluded.returns,
+                loan_days = loan_days + excluded.loan_days, copies_added = copies_added + excluded.copies_added,
+                copies_removed = copies_removed + excluded.copies_removed;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS circulation_events_loan_rollup AFTER INSERT ON circulation_events
+        WHEN new.event IN ('issue', 'return') BEGIN
+            INSERT INTO category_circulation (month, category, issues, returns, loan_days)
+            VALUES (substr(new.day, 1, 7), new.category, new.event = 'issue', new.event = 'return',
+                    COALESCE(new.loan_days, 0))
+            ON CONFLICT (month, category) DO UPDATE SET
+                issues = issues + excluded.issues, returns = returns + excluded.returns,
+                loan_days = loan_days + excluded.loan_days;
+            INSERT INTO category_totals (category, issues, returns, loan_days)
+            VALUES (new.category, new.event = 'issue', new.event = 'return', COALESCE(new.loan_days, 0))
+            ON CONFLICT (category) DO UPDATE SET
+                issues = issues + excluded.issues, returns = returns + excluded.returns,
+                loan_days = loan_days + excluded.loan_days;
+            INSERT INTO user_circulation (user_id, issues, returns, loan_days, last_day)
+            VALUES (new.user_id, new.event = 'issue', new.event = 'return', COALESCE(new.loan_days, 0), new.day)
+            ON CONFLICT (user_id) DO UPDATE SET
+                issues = issues + excluded.issues, returns = returns + excluded.returns,
+                loan_days = loan_days + excluded.loan_days, last_day = MAX(last_day, excluded.last_day);
+            INSERT INTO title_circulation (book_id, issues, returns, loan_days, last_day)
+            VALUES (new.book_id, new.event = 'issue', new.event = 'return', COALESCE(new.loan_days, 0), new.day)
+            ON CONFLICT (book_id) DO UPDATE SET
+                issues = issues + excluded.issues, returns = returns + excluded.returns,
+                loan_days = loan_days + excluded.loan_days, last_day = MAX(last_day, excluded.last_day);
+        END;
+
+        -- Loans inserted already returned (imports, generated history) log both events
+        CREATE TRIGGER IF NOT EXISTS transactions_log_issue AFTER INSERT ON transactions BEGIN
+            INSERT INTO circulation_events (event, day, book_id, copy_id, user_id, transaction_id, category)
+            VALUES ('issue', new.issue_date, new.book_id, new.copy_id, new.user_id, new.id,
+                    COALESCE((SELECT category FROM books WHERE id = new.book_id), 'Unknown'));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS transactions_log_inserted_return AFTER INSERT ON transactions
+        WHEN new.status = 'returned' BEGIN
+            INSERT INTO circulation_events (event, day, book_id, copy_id, user_id, transaction_id, category, loan_days)
+            VALUES ('return', COALESCE(new.return_date, new.issue_date), new.book_id, new.copy_id, new.user_id, new.id,
+                    COALESCE((SELECT category FROM books WHERE id = new.book_id), 'Unknown'),
+                    CAST(julianday(COALESCE(new.return_date, new.issue_date)) - julianday(new.issue_date) AS INTEGER));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS transactions_log_return AFTER UPDATE OF status ON transactions
+        WHEN old.status = 'issued' AND new.status = 'returned' BEGIN
+            INSERT INTO circulation_events (event, day, book_id, copy_id, user_id, transaction_id, category, loan_days)
+            VALUES ('return', COALESCE(new.return_date, new.issue_date), new.book_id, new.copy_id, new.user_id, new.id,
+                    COALESCE((SELECT category FROM books WHERE id = new.book_id), 'Unknown'),
+                    CAST(julianday(COALESCE(new.return_date, new.issue_date)) - julianday(new.issue_date) AS INTEGER));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS book_copies_log_add AFTER INSERT ON book_copies BEGIN
+            INSERT INTO circulation_events (event, day, book_id, copy_id, category)
+            VALUES ('add', date('now', 'localtime'), new.book_id, new.id,
+                    COALESCE((SELECT category FROM books WHERE id = new.book_id), 'Unknown'));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS book_copies_log_remove AFTER DELETE ON book_copies BEGIN
+            INSERT INTO circulation_events (event, day, book_id, copy_id, category)
+            VALUES ('remove', date('now', 'localtime'), old.book_id, old.id,
+                    COALESCE((SELECT category FROM books WHERE id = old.book_id), 'Unknown'));
+        END;
+    '''),
+    (8, 'archive for old returned loans', '''
+        -- Returned loans past the archive cutoff move here (archive.py), so
+        -- transactions and its indexes hold only open and recent loans. Rows
+        -- keep their transaction id; AUTOINCREMENT never hands it out again.
+        CREATE TABLE IF NOT EXISTS transactions_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            copy_id INTEGER,
+            issue_date TEXT NOT NULL,
+            return_date TEXT NOT NULL,
+            archived_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+        );
+
+        -- Full loan history of one user, newest first
+        CREATE INDEX IF NOT EXISTS idx_transactions_archive_user
+            ON transactions_archive (user_id, return_date);
+    '''),
+    (9, 'background jobs, overdue snapshot and reminder outbox', '''
+        -- One row per job in jobs.JOBS. A runner claims a due job by moving it
+        -- from idle to queued with a lease; an expired lease (crashed runner)
+        -- makes it claimable again. Times are local 'YYYY-MM-DD HH:MM:SS'.
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            every_seconds INTEGER NOT NULL,
+            at TEXT,
+            next_run TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'idle',
+            lease_until TEXT,
+            runner TEXT,
+            last_started TEXT,
+            last_finished TEXT,
+            last_duration_ms INTEGER,
+            last_status TEXT,
+            last_result TEXT,
+            last_error TEXT,
+            runs INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0
+        );
+
+        -- Overdue loans and fines as of computed_on, rebuilt by the overdue job
+        CREATE TABLE IF NOT EXISTS overdue_loans (
+            transaction_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            issue_date TEXT NOT NULL,
+            days_out INTEGER NOT NULL,
+            fine INTEGER NOT NULL,
+            computed_on TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_overdue_loans_user
+            ON overdue_loans (user_id);
+
+        -- Reminders are written here in the job's transaction, then delivered
+        -- to the sink and marked; at most one per user per day
+        CREATE TABLE IF NOT EXISTS reminder_outbox (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            loans INTEGER NOT NULL,
+            fine INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime')),
+            delivered_at TEXT,
+            UNIQUE (user_id, day)
+        );
+        CREATE INDEX IF NOT EXISTS idx_reminder_outbox_pending
+            ON reminder_outbox (id) WHERE delivered_at IS NULL;
+    '''),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+class MigrationError(RuntimeError):
+    """A pending migration cannot run until the data is fixed by hand"""
+
+def duplicate_open_loans(conn):
+    """Why the one-open-loan indexes cannot be built, or None.
+
+    The old issue path could hand one book to two people; such loans would
+    make CREATE UNIQUE INDEX fail, so list them instead.
+    """
+    rows = conn.execute('''
+        SELECT book_id, group_concat(id, ', ') FROM (
+            SELECT book_id, id FROM transactions WHERE status = 'issued' ORDER BY book_id, id
+        )
+        GROUP BY book_id HAVING COUNT(*) > 1
+    ''').fetchall()
+    if not rows:
+        return None
+    listing = '; '.join(f'book {book_id}: transactions {ids}' for book_id, ids in rows)
+    return (f'books issued more than once at the same time ({listing}). Keep the earliest loan of each '
+            "book and return the others, e.g. UPDATE transactions SET status = 'returned', "
+            "return_date = date('now', 'localtime') WHERE id IN (...), then run init-db again")
+
+# Version -> check(conn) run before that migration; a message it returns aborts the upgrade.
+# Before 6 copy ids are book ids, so its per-copy index has the same duplicates.
+PREFLIGHT = {
+    4: duplicate_open_loans,
+    6: duplicate_open_loans,
+}
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Apply pending migrations, each in its own transaction. Returns versions applied."""
+    applied = []
+    version = current_version(conn)
+    for number, description, script in MIGRATIONS:
+        if number <= version:
+            continue
+        problem = number in PREFLIGHT and PREFLIGHT[number](conn)
+        if problem:
+            raise MigrationError(f'Cannot apply migration {number} ({description}): {problem}')
+        try:
+            conn.executescript(f'''
+                BEGIN;
+                {script}
+                PRAGMA user_version = {number};
+                COMMIT;
+            ''')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        applied.append((number, description))
+    return applied
+
+def plan_problems(detail, allowed_steps=()):
+    """Return why a single EXPLAIN QUERY PLAN step is a regression, or None"""
+    if any(step in detail for step in allowed_steps):
+        return None
+    if detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail:
+        return 'full scan'
+    if 'USE TEMP B-TREE' in detail:
+        return 'sort without an index'
+    return None
+
+def check_query_plans(conn, queries):
+    """EXPLAIN every query; queries maps a name to (sql, params, plan steps accepted as they are).
+
+    Returns a list of (query name, plan step, problem).
+    """
+    failures = []
+    for name, (sql, params, allowed_steps) in queries.items():
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+            problem = plan_problems(row[3], allowed_steps)
+            if problem:
+                failures.append((name, row[3], problem))
+    return failures
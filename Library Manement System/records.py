@@ -0,0 +1,49 @@
+"""Compact records for large result sets.
+
+A sqlite3.Row carries its values plus a reference to the cursor description,
+and dict(row) a whole hash table per row. A record is a named tuple: the
+values and nothing else. It still answers row.name, row['name'], row[0],
+keys() and dict(row), so templates and callers written against sqlite3.Row
+keep working. Record types are built from the column names of the query, so
+the SELECT list is the schema; name the columns you need instead of `*`.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+@lru_cache(maxsize=128)
+def record_type(fields):
+    """Named tuple class for these column names, with sqlite3.Row-style access by name"""
+    base = namedtuple('Record', fields, rename=True)
+    positions = {field: index for index, field in enumerate(fields)}
+
+    class Record(base):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                try:
+                    key = positions[key]
+                except KeyError:
+                    raise IndexError(f'No item with that key: {key!r}') from None
+            return tuple.__getitem__(self, key)
+
+        def keys(self):
+            return list(fields)
+
+        @classmethod
+        def from_row(cls, cursor, row):
+            return tuple.__new__(cls, row)
+
+    return Record
+
+def query_records(conn, sql, params=()):
+    """Execute sql and return its cursor, yielding records lazily.
+
+    Iterate it to stream rows, or call fetchall() for a list.
+    """
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    # Rows go through the factory at fetch time, so it can follow the description
+    if cursor.description is not None:
+        cursor.row_factory = record_type(tuple(column[0] for column in cursor.description)).from_row
+    return cursor
@@ -0,0 +1,112 @@
+"""Circulation statistics read from the rollups kept by migration 7's triggers.
+
+Every issue, return, copy added and copy removed is appended to
+circulation_events in the same transaction as the change, and a trigger on
+that table folds it into daily_circulation, category_circulation,
+category_totals, user_circulation and title_circulation. The statistics view
+reads only bounded windows of those rollups (a month of days, a year of
+months, the top ten by index), so its cost does not grow with years of history.
+"""
+from datetime import date, timedelta
+
+from records import query_records
+
+STATS_DAYS = 30
+STATS_MONTHS = 12
+TOP_N = 10
+
+def months_back(today, count):
+    """First month ('YYYY-MM') of the count months ending with today's"""
+    month_index = today.year * 12 + today.month - 1 - (count - 1)
+    return f'{month_index // 12:04d}-{month_index % 12 + 1:02d}'
+
+def circulation_stats(conn, today=None):
+    """Template context for the admin statistics view"""
+    today = today or date.today()
+    daily = query_records(conn, '''
+        SELECT day, issues, returns, loan_days, copies_added, copies_removed
+        FROM daily_circulation WHERE day > ? ORDER BY day
+    ''', ((today - timedelta(days=STATS_DAYS)).isoformat(),)).fetchall()
+    monthly = query_records(conn, '''
+        SELECT month, category, issues, returns, loan_days
+        FROM category_circulation WHERE month >= ? ORDER BY month, category
+    ''', (months_back(today, STATS_MONTHS),)).fetchall()
+    categories = query_records(conn, '''
+        SELECT category, issues, returns, loan_days FROM category_totals ORDER BY issues DESC, category
+    ''').fetchall()
+    top_titles = query_records(conn, '''
+        SELECT t.book_id, COALESCE(b.title, '(removed)') as title, b.author, t.issues, t.returns, t.last_day
+        FROM title_circulation t LEFT JOIN books b ON b.id = t.book_id
+        ORDER BY t.issues DESC, t.book_id LIMIT ?
+    ''', (TOP_N,)).fetchall()
+    top_borrowers = query_records(conn, '''
+        SELECT c.user_id, COALESCE(u.name, u.admission_number, '(removed)') as name, u.user_type,
+               c.issues, c.returns, c.last_day
+        FROM user_circulation c LEFT JOIN users u ON u.id = c.user_id
+        ORDER BY c.issues DESC, c.user_id LIMIT ?
+    ''', (TOP_N,)).fetchall()
+
+    issues = sum(row.issues for row in categories)
+    returns = sum(row.returns for row in categories)
+    loan_days = sum(row.loan_days for row in categories)
+    return {
+        'daily': daily,
+        'monthly': monthly,
+        'categories': categories,
+        'top_titles': top_titles,
+        'top_borrowers': top_borrowers,
+        'totals': {
+            'issues': issues,
+            'returns': returns,
+            'on_loan': issues - returns,
+            'average_loan_days': round(loan_days / returns, 1) if returns else 0,
+        },
+        'stats_days': STATS_DAYS,
+        'stats_months': STATS_MONTHS,
+    }
+
+# Rollup table -> the same rows recomputed from circulation_events
+ROLLUPS = {
+    'daily_circulation': ('''
+        SELECT day, issues, returns, loan_days, copies_added, copies_removed FROM daily_circulation
+    ''', '''
+        SELECT day, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0)),
+               SUM(event = 'add'), SUM(event = 'remove')
+        FROM circulation_events GROUP BY day
+    '''),
+    'category_circulation': ('''
+        SELECT month, category, issues, returns, loan_days FROM category_circulation
+    ''', '''
+        SELECT substr(day, 1, 7), category, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0))
+        FROM circulation_events WHERE event IN ('issue', 'return') GROUP BY substr(day, 1, 7), category
+    '''),
+    'category_totals': ('''
+        SELECT category, issues, returns, loan_days FROM category_totals
+    ''', '''
+        SELECT category, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0))
+        FROM circulation_events WHERE event IN ('issue', 'return') GROUP BY category
+    '''),
+    'user_circulation': ('''
+        SELECT user_id, issues, returns, loan_days, last_day FROM user_circulation
+    ''', '''
+        SELECT user_id, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0)), MAX(day)
+        FROM circulation_events WHERE event IN ('issue', 'return') GROUP BY user_id
+    '''),
+    'title_circulation': ('''
+        SELECT book_id, issues, returns, loan_days, last_day FROM title_circulation
+    ''', '''
+        SELECT book_id, SUM(event = 'issue'), SUM(event = 'return'), SUM(COALESCE(loan_days, 0)), MAX(day)
+        FROM circulation_events WHERE event IN ('issue', 'return') GROUP BY book_id
+    '''),
+}
+
+def verify_rollups(conn):
+    """Recompute every rollup from the event log; returns (table, rows that differ) for each mismatch"""
+    mismatches = []
+    for table, (stored, recomputed) in ROLLUPS.items():
+        # Compound selects associate left to right, so each direction is counted on its own
+        differing = sum(conn.execute(f'SELECT COUNT(*) FROM ({first} EXCEPT {second})').fetchone()[0]
+                        for first, second in ((stored, recomputed), (recomputed, stored)))
+        if differing:
+            mismatches.append((table, differing))
+    return mismatches
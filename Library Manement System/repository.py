@@ -0,0 +1,275 @@
+"""Read-side data access for the dashboards and search"""
+import base64
+import json
+
+from archive import ARCHIVE_BATCH, MOVE_BATCH
+from auth import LOGIN_QUERIES
+from circulation import CLAIM_COPY, OPEN_LOANS_FOR_BOOK
+from database import (BOOK_COLUMNS, cached_catalogue, catalogue_cache, get_available_count, get_categories,
+                      search_books)
+from records import query_records
+from reports import circulation_stats
+
+def user_loans(conn, user_id, include_archive=False):
+    """Issued and returned loans for one user, with fines, in a single query.
+
+    Loans archived by archive.py are left out unless include_archive is set.
+    """
+    sql = '''
+        SELECT b.title, b.author, b.code, t.issue_date as issue_date, t.return_date, t.status,
+               t.id as transaction_id, COALESCE(f.fine, 0) as fine
+        FROM transactions t
+        JOIN books b ON t.book_id = b.id
+        LEFT JOIN loan_fines f ON f.transaction_id = t.id
+        WHERE t.user_id = ? AND t.status IN ('issued', 'returned')
+    '''
+    params = (user_id,)
+    if include_archive:
+        sql += '''
+        UNION ALL
+        SELECT b.title, b.author, b.code, a.issue_date, a.return_date, 'returned' as status,
+               a.id as transaction_id, 0 as fine
+        FROM transactions_archive a
+        JOIN books b ON a.book_id = b.id
+        WHERE a.user_id = ?
+    '''
+        params += (user_id,)
+    # Newest first, across both halves of the UNION ALL
+    sql += '''
+        ORDER BY issue_date DESC, transaction_id DESC
+    '''
+    return query_records(conn, sql, params).fetchall()
+
+def user_dashboard(conn, user_id, include_archive=False):
+    """Template context for the student and employee dashboards"""
+    issued_books = []
+    returned_books = []
+    for loan in user_loans(conn, user_id, include_archive):
+        (issued_books if loan['status'] == 'issued' else returned_books).append(loan)
+    return {
+        'issued_books': issued_books,
+        'returned_books': returned_books,
+        # The dashboards show ten titles and a count, not the whole shelf: both are
+        # cheap to reload after every issue and return
+        'available_books': catalogue_page(conn, 'available_books')[0],
+        'available_count': get_available_count(conn),
+        'total_fine': sum(loan['fine'] for loan in issued_books),
+        'full_history': include_archive,
+    }
+
+# Keyset-paginated admin tables: (select, filter, seek columns, cursor fields, descending, page size)
+ADMIN_PAGES = {
+    'issued': ('''
+        SELECT b.title, b.author, b.code, f.issue_date, u.name, u.user_type, f.transaction_id, f.fine
+        FROM loan_fines f
+        JOIN books b ON f.book_id = b.id
+        JOIN users u ON f.user_id = u.id
+    ''', '1 = 1', ('f.issue_date', 'f.transaction_id'), ('issue_date', 'transaction_id'), True, 25),
+    'returned': ('''
+        SELECT b.title, b.author, b.code, t.issue_date, t.return_date, u.name, u.user_type, t.id as transaction_id
+        FROM transactions t
+        JOIN books b ON t.book_id = b.id
+        JOIN users u ON t.user_id = u.id
+    ''', "t.status = 'returned'", ('t.return_date', 't.id'), ('return_date', 'transaction_id'), True, 10),
+    'books': (f'''
+        SELECT {', '.join(BOOK_COLUMNS)} FROM books
+    ''', '1 = 1', ('title', 'id'), ('title', 'id'), False, 15),
+    'available_books': (f'''
+        SELECT {', '.join(BOOK_COLUMNS)} FROM books
+    ''', 'available = 1', ('title', 'id'), ('title', 'id'), False, 50),
+    'users': ('''
+        SELECT id, name, user_type, admission_number, department,
+               COALESCE(name, admission_number, '') as sort_name
+        FROM users
+    ''', "user_type != 'admin'", ('user_type', "COALESCE(name, admission_number, '')", 'id'),
+        ('user_type', 'sort_name', 'id'), False, 50),
+}
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor):
+    """The seek values in a cursor, or None unless it is a list of strings and numbers"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or not all(isinstance(value, (str, int, float)) for value in values):
+        return None
+    return values
+
+def fetch_admin_page(conn, name, cursor=None, limit=None):
+    """Fetch one page of an admin table using a seek predicate instead of OFFSET"""
+    select, where, seek_columns, cursor_fields, descending, page_size = ADMIN_PAGES[name]
+    limit = max(1, min(limit or page_size, 200))
+    params = []
+    if cursor is not None:
+        comparison = '<' if descending else '>'
+        where += f" AND ({', '.join(seek_columns)}) {comparison} ({', '.join('?' * len(seek_columns))})"
+        params.extend(cursor)
+    direction = 'DESC' if descending else 'ASC'
+    order_by = ', '.join(f'{column} {direction}' for column in seek_columns)
+    rows = query_records(conn, f'{select} WHERE {where} ORDER BY {order_by} LIMIT ?',
+                         params + [limit + 1]).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][field] for field in cursor_fields])
+    return rows, next_cursor
+
+def catalogue_page(conn, name):
+    """First page of a books-only admin table, shared by every dashboard until books change"""
+    return cached_catalogue(f'{name}_page', lambda: fetch_admin_page(conn, name))
+
+def admin_dashboard(conn):
+    """First page of every admin table plus the headline counts.
+
+    The book pages and category list only change with the catalogue, so they
+    come from the catalogue cache; the rest is four queries.
+    """
+    context = {}
+    for name in ADMIN_PAGES:
+        if name in CATALOGUE_PAGES:
+            rows, next_cursor = catalogue_page(conn, name)
+        else:
+            rows, next_cursor = fetch_admin_page(conn, name)
+        context[f'{name}_page'] = rows
+        context[f'{name}_next'] = next_cursor
+    context['counts'] = conn.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM transactions WHERE status = 'issued') as issued,
+            (SELECT COALESCE(SUM(returns), 0) FROM category_totals) as returned,
+            (SELECT COUNT(*) FROM books) as books,
+            (SELECT COUNT(*) FROM users WHERE user_type != 'admin') as users
+    ''').fetchone()
+    context['categories'] = get_categories(conn)
+    return context
+
+# Pages whose rows depend only on the books table
+CATALOGUE_PAGES = ('books', 'available_books')
+
+def dashboard(conn, user_type, user_id):
+    """Template context for the dashboard of the given role"""
+    if user_type == 'admin':
+        return admin_dashboard(conn)
+    return user_dashboard(conn, user_id)
+
+class QueryCounter:
+    """Count the SQL statements run on a connection, e.g. to enforce a per-view budget"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+
+    def __enter__(self):
+        self.conn.set_trace_callback(self._trace)
+        return self
+
+    def _trace(self, statement):
+        # Skip the statements SQLite runs on our behalf: trigger and virtual
+        # table sub-statements ("-- ..."), and FTS5 shadow-table housekeeping
+        if not statement.startswith('--') and "'main'." not in statement:
+            self.statements.append(statement)
+
+    def __exit__(self, *exc_info):
+        self.conn.set_trace_callback(None)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+# Most statements each view may run: (cold catalogue cache, warm catalogue cache)
+QUERY_BUDGETS = {
+    'student dashboard': (3, 1),
+    'employee dashboard': (3, 1),
+    'admin dashboard': (7, 4),
+    'student search': (4, 2),
+    'admin search': (8, 5),
+}
+
+def check_query_budgets(conn):
+    """Run every view's data access with a cold and then a warm cache.
+
+    Returns (scenario, statements run, budget) for each run.
+    """
+    student = conn.execute("SELECT id FROM users WHERE user_type = 'student' LIMIT 1").fetchone()
+    employee = conn.execute("SELECT id FROM users WHERE user_type = 'employee' LIMIT 1").fetchone()
+    scenarios = {
+        'student dashboard': lambda: dashboard(conn, 'student', student and student[0]),
+        'employee dashboard': lambda: dashboard(conn, 'employee', employee and employee[0]),
+        'admin dashboard': lambda: dashboard(conn, 'admin', None),
+        'student search': lambda: (search_books(conn, 'the'), dashboard(conn, 'student', student and student[0])),
+        'admin search': lambda: (search_books(conn, 'the'), dashboard(conn, 'admin', None)),
+    }
+    results = []
+    for name, run in scenarios.items():
+        for label, budget in zip(('cold', 'warm'), QUERY_BUDGETS[name]):
+            if label == 'cold':
+                catalogue_cache.clear()
+            with QueryCounter(conn) as counter:
+                run()
+            results.append((f'{name} ({label} cache)', counter.count, budget))
+    return results
+
+def seek_admin_pages(conn):
+    """Fetch every admin table from a cursor at its first row, to exercise the seek predicates"""
+    for name, (_, _, _, cursor_fields, _, _) in ADMIN_PAGES.items():
+        rows, _ = fetch_admin_page(conn, name)
+        if rows:
+            fetch_admin_page(conn, name, [rows[0][field] for field in cursor_fields])
+
+# Views whose statements check-query-plans traces and EXPLAINs, as run with cold caches
+PLAN_VIEWS = {
+    'student dashboard': lambda conn, user_id: user_dashboard(conn, user_id, include_archive=True),
+    'admin dashboard': lambda conn, user_id: admin_dashboard(conn),
+    'admin next pages': lambda conn, user_id: seek_admin_pages(conn),
+    'search': lambda conn, user_id: search_books(conn, 'the'),
+    'statistics': lambda conn, user_id: circulation_stats(conn),
+}
+
+# (fragment of the statement, plan step) pairs accepted as they are: index walks a LIMIT stops
+# early, tables with a row per category, sorting one user's loans, and counts and lists cached
+# until the catalogue changes
+PLAN_ALLOWANCES = (
+    ('ORDER BY issue_date DESC, transaction_id DESC', 'USE TEMP B-TREE FOR ORDER BY'),
+    ('SELECT COUNT(*) FROM books WHERE available = 1', 'SCAN books'),
+    ('ORDER BY title ASC, id ASC LIMIT', 'USING INDEX idx_books_title'),
+    ('ORDER BY title ASC, id ASC LIMIT', 'USING INDEX idx_books_available_title'),
+    ('ORDER BY f.issue_date DESC, f.transaction_id DESC LIMIT', 'USING INDEX idx_transactions_issued_date'),
+    ('ORDER BY t.return_date DESC, t.id DESC LIMIT', 'USING INDEX idx_transactions_returned_date'),
+    ('ORDER BY user_type ASC', 'USING INDEX idx_users_listing'),
+    ('ORDER BY t.issues DESC, t.book_id LIMIT', 'USING INDEX idx_title_circulation_issues'),
+    ('ORDER BY c.issues DESC, c.user_id LIMIT', 'USING INDEX idx_user_circulation_issues'),
+    ('SELECT (SELECT COUNT(*) FROM transactions', 'SCAN CONSTANT ROW'),
+    ('SELECT (SELECT COUNT(*) FROM transactions', 'USING INDEX idx_transactions_open_book'),
+    ('SELECT (SELECT COUNT(*) FROM transactions', 'USING COVERING INDEX'),
+    ('FROM category_totals', 'SCAN category_totals'),
+    ('FROM category_totals ORDER BY', 'USE TEMP B-TREE FOR ORDER BY'),
+    ('SELECT DISTINCT category FROM books', 'SCAN books'),
+    ('SELECT DISTINCT category FROM books', 'USE TEMP B-TREE FOR DISTINCT'),
+)
+
+def hot_queries(conn):
+    """The statements check-query-plans EXPLAINs: {name: (sql, params, accepted plan steps)}.
+
+    The read views are run under a QueryCounter, so the statements checked are
+    the ones the app actually executes (with their values inlined); the writes
+    and logins are checked through the SQL their modules run.
+    """
+    student = conn.execute("SELECT id FROM users WHERE user_type = 'student' LIMIT 1").fetchone()
+    queries = {}
+    for view, run in PLAN_VIEWS.items():
+        catalogue_cache.clear()
+        with QueryCounter(conn) as counter:
+            run(conn, student and student[0])
+        for number, statement in enumerate(counter.statements, 1):
+            sql = ' '.join(statement.split())
+            allowed = tuple(step for fragment, step in PLAN_ALLOWANCES if fragment in sql)
+            queries[f'{view} #{number} ({sql[:60]}...)'] = (sql, (), allowed)
+    catalogue_cache.clear()
+    for user_type, (sql, fields) in LOGIN_QUERIES.items():
+        queries[f'{user_type} login'] = (sql, ('',) * len(fields), ())
+    queries['claim a shelf copy'] = (CLAIM_COPY, (1,), ())
+    queries['open loans for book'] = (OPEN_LOANS_FOR_BOOK, (1,), ())
+    queries['archive batch'] = (MOVE_BATCH, ('2000-01-01', ARCHIVE_BATCH), ())
+    return queries
@@ -0,0 +1,265 @@
+"""Server-side sessions: the cookie carries only a signed session id.
+
+Session data lives in a key/value store with a Redis-style interface (get,
+set with ex, delete, incr): a local SQLite file by default, an in-memory
+stand-in for development, or Redis itself. Each worker keeps recently read
+sessions in an LRU keyed by (session id, version, `sessions` generation), so
+a request normally costs no store round-trip. Revocation bumps an epoch in the
+store and the `sessions` generation, which drops every worker's cached copy.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer
+
+from cache import LRUCache
+
+GLOBAL_EPOCH = 'sessions:epoch'
+
+def user_epoch_key(user_id):
+    return f'user:{user_id}:epoch'
+
+def session_key(sid):
+    return f'session:{sid}'
+
+def as_text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+class MemoryStore:
+    """In-process stand-in for Redis; sessions do not survive a restart or span workers"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def incr(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (0, None))
+            value = int(value) + 1
+            self._data[key] = (value, expires)
+            return value
+
+class SQLiteStore:
+    """Redis-style key/value store in its own SQLite file, shared by every worker"""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires REAL
+                ) WITHOUT ROWID
+            ''')
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._connect().execute('''
+                SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)
+            ''', (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)',
+                         (key, value, time.time() + ex if ex else None))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute('DELETE FROM kv WHERE expires <= ?', (time.time(),))
+        return True
+
+    def delete(self, *keys):
+        if not keys:
+            return 0
+        with self._lock:
+            return self._connect().execute(
+                f"DELETE FROM kv WHERE key IN ({', '.join('?' * len(keys))})", keys
+            ).rowcount
+
+    def incr(self, key):
+        with self._lock:
+            return self._connect().execute('''
+                INSERT INTO kv (key, value) VALUES (?, 1)
+                ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+                RETURNING value
+            ''', (key,)).fetchone()[0]
+
+def open_store(spec, database):
+    """Build the store named by SESSION_STORE: 'sqlite', 'memory' or a redis:// URL"""
+    if spec == 'memory':
+        return MemoryStore()
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('SESSION_STORE is a Redis URL but the redis package is not installed') from None
+        return redis.Redis.from_url(spec)
+    if spec == 'sqlite':
+        return SQLiteStore(database + '-sessions')
+    raise RuntimeError(f'Unknown SESSION_STORE {spec!r}; use sqlite, memory or a redis:// URL')
+
+class StoredSession(SecureCookieSession):
+    def __init__(self, generation, initial=None, sid=None, version=0, epochs=None):
+        super().__init__(initial)
+        self.generation = generation
+        self.sid = sid
+        self.version = version
+        self.epochs = epochs
+        self.loaded_user_id = (initial or {}).get('user_id')
+
+class StoreSessionInterface(SessionInterface):
+    """Flask session interface backed by a SessionStore-compatible object"""
+
+    serializer = TaggedJSONSerializer()
+    salt = 'library-session'
+
+    def __init__(self, store, generations, cache_size=4096, cache_ttl=60):
+        self.store = store
+        self.generations = generations
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def epoch(self, key):
+        return int(self.store.get(key) or 0)
+
+    def load(self, sid):
+        """The stored record for sid, or None if it is missing, expired or revoked"""
+        raw = self.store.get(session_key(sid))
+        if raw is None:
+            return None
+        record = json.loads(as_text(raw))
+        if record['epoch'] != self.epoch(GLOBAL_EPOCH):
+            return None
+        user_id = record['user_id']
+        if user_id is not None and record['user_epoch'] != self.epoch(user_epoch_key(user_id)):
+            return None
+        return record
+
+    def open_session(self, app, request):
+        generation = self.generations.get('sessions')
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return StoredSession(generation)
+        try:
+            sid, version = self.signer(app).unsign(cookie).decode().rsplit('.', 1)
+            version = int(version)
+        except (BadSignature, ValueError):
+            return StoredSession(generation)
+
+        record = self.cache.get((sid, version, generation), lambda: self.load(sid))
+        if record is None:
+            return StoredSession(generation)
+        # Deserialised per request: flashes mutate nested lists in place
+        return StoredSession(generation, self.serializer.loads(record['data']), sid, record['version'],
+                             (record['epoch'], record['user_epoch']))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        cookie = dict(domain=self.get_cookie_domain(app), path=self.get_cookie_path(app),
+                      secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app),
+                      httponly=self.get_cookie_httponly(app))
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        user_id = session.get('user_id')
+        if session.sid and (not session or user_id != session.loaded_user_id):
+            # Logged out or switched user: the old id must stop working everywhere
+            self.store.delete(session_key(session.sid))
+            if session.loaded_user_id is not None:
+                self.generations.bump('sessions')
+            session.sid = None
+
+        if not session:
+            if session.modified:
+                response.delete_cookie(name, **cookie)
+                response.vary.add('Cookie')
+            return
+        if not self.should_set_cookie(app, session):
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(24)
+            session.version = 0
+            session.epochs = (self.epoch(GLOBAL_EPOCH),
+                              self.epoch(user_epoch_key(user_id)) if user_id is not None else None)
+        session.version += 1
+        record = {
+            'version': session.version,
+            'user_id': user_id,
+            'epoch': session.epochs[0],
+            'user_epoch': session.epochs[1],
+            'data': self.serializer.dumps(dict(session)),
+        }
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        self.store.set(session_key(session.sid), json.dumps(record), ex=lifetime)
+        # Cached under the generation seen at open: a revocation since then hides it
+        self.cache.put((session.sid, session.version, session.generation), record)
+
+        value = self.signer(app).sign(f'{session.sid}.{session.version}').decode()
+        response.set_cookie(name, value, expires=self.get_expiration_time(app, session), **cookie)
+        response.vary.add('Cookie')
+
+    def revoke_user(self, user_id):
+        """Log one user out of every browser"""
+        self.store.incr(user_epoch_key(user_id))
+        self.generations.bump('sessions')
+
+    def revoke_all(self):
+        """Log everyone out"""
+        self.store.incr(GLOBAL_EPOCH)
+        self.generations.bump('sessions')
+
+    def stats(self):
+        return self.cache.stats()
+
+def init_sessions(app, database, generations):
+    interface = StoreSessionInterface(
+        open_store(os.environ.get('SESSION_STORE', 'sqlite'), database),
+        generations,
+        cache_ttl=int(os.environ.get('SESSION_CACHE_TTL', 60)),
+    )
+    app.session_interface = interface
+    return interface
@@ -0,0 +1,208 @@
+"""Search-as-you-type over titles, authors and codes from an in-memory prefix index.
+
+Every word of a book's title, author and code is an entry in one sorted list,
+with the book id in a parallel array, so the books whose words start with a
+prefix are one bisect away. Each distinct word is stored once (titles share
+most of theirs), and nothing else about a book is kept in memory: the few
+matching rows are read back by primary key, which also drops any book removed
+since.
+
+Each worker builds its own index once, from the books table, and keeps it in
+step with add/remove through the circulation event log (copy added, copy
+removed), read only when the books generation moves.
+"""
+import gc
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+
+from database import generations, read_pool
+
+SUGGEST_LIMIT = 10
+# Candidates read back per request, so multi-word prefixes still fill the list
+SUGGEST_SCAN = 50
+# More changed titles than this since the last sync and a rebuild is cheaper
+REBUILD_AFTER = 1000
+
+WORD = re.compile(r'\w+')
+# Sorts after any character, so prefix + LAST_CHAR bounds every word with that prefix
+LAST_CHAR = chr(0x10FFFF)
+
+def normalize(text):
+    """Casefold and strip diacritics, like the FTS tokenizer (remove_diacritics 2)"""
+    if text is None or text.isascii():
+        return (text or '').lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+def words(text):
+    return WORD.findall(normalize(text))
+
+def book_terms(title, author, code):
+    """The index entries of one book: its distinct words of two or more characters"""
+    return {word for word in words(f'{title} {author} {code}') if len(word) > 1}
+
+class PrefixIndex:
+    def __init__(self):
+        self._keys = []
+        self._ids = array('q')
+        self._lock = threading.RLock()
+        self.generation = None
+        self.last_event = 0
+        self.builds = 0
+
+    @property
+    def built(self):
+        return self.generation is not None
+
+    def load(self, books):
+        """Replace the index with (id, title, author, code) rows"""
+        # Millions of short-lived lists would set off full collections that find no cycles
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # One string per distinct word, shared by all its entries
+            postings = {}
+            for book_id, title, author, code in books:
+                for term in book_terms(title, author, code):
+                    postings.setdefault(term, []).append(book_id)
+            keys = []
+            ids = array('q')
+            for term in sorted(postings):
+                book_ids = postings.pop(term)
+                book_ids.sort()
+                keys.extend([term] * len(book_ids))
+                ids.extend(book_ids)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        with self._lock:
+            self._keys, self._ids = keys, ids
+            self.builds += 1
+
+    def build(self, conn):
+        """(Re)build from the books table, remembering where the event log stood"""
+        with self._lock:
+            # Read the markers before the data, so changes in between are replayed by sync()
+            generation = generations.get('books')
+            self.last_event = conn.execute('SELECT COALESCE(MAX(id), 0) FROM circulation_events').fetchone()[0]
+            self.load(conn.execute('SELECT id, title, author, code FROM books ORDER BY id'))
+            self.generation = generation
+
+    def add(self, book_id, title, author, code):
+        with self._lock:
+            for term in book_terms(title, author, code):
+                start = bisect_left(self._keys, term)
+                end = bisect_right(self._keys, term, start)
+                position = bisect_left(self._ids, book_id, start, end)
+                if position < end and self._ids[position] == book_id:
+                    continue
+                self._keys.insert(position, self._keys[start] if start < end else term)
+                self._ids.insert(position, book_id)
+
+    def remove(self, book_id):
+        """Drop every entry of a book; a scan of the id array, as nothing maps ids to words"""
+        with self._lock:
+            positions = []
+            try:
+                while True:
+                    positions.append(self._ids.index(book_id, positions[-1] + 1 if positions else 0))
+            except ValueError:
+                pass
+            for position in reversed(positions):
+                del self._keys[position]
+                del self._ids[position]
+
+    def sync(self, conn):
+        """Apply titles added or removed since the last build or sync; cheap when nothing moved"""
+        generation = generations.get('books')
+        if generation == self.generation:
+            return
+        with self._lock:
+            if not self.built:
+                self.build(conn)
+                return
+            last_event = conn.execute('SELECT COALESCE(MAX(id), 0) FROM circulation_events').fetchone()[0]
+            changed = [row[0] for row in conn.execute('''
+                SELECT DISTINCT book_id FROM circulation_events
+                WHERE id > ? AND id <= ? AND event IN ('add', 'remove')
+            ''', (self.last_event, last_event))]
+            if len(changed) > REBUILD_AFTER:
+                self.build(conn)
+                return
+            for book_id in changed:
+                book = conn.execute('SELECT title, author, code FROM books WHERE id = ?', (book_id,)).fetchone()
+                if book is None:
+                    self.remove(book_id)
+                else:
+                    self.add(book_id, *book)
+            self.last_event = last_event
+            self.generation = generation
+
+    def _range(self, prefix):
+        start = bisect_left(self._keys, prefix)
+        return start, bisect_left(self._keys, prefix + LAST_CHAR, start)
+
+    def candidates(self, prefixes, limit):
+        """Up to limit book ids with a word starting with the rarest of the prefixes"""
+        found = {}
+        with self._lock:
+            start, end = min((self._range(prefix) for prefix in prefixes), key=lambda bounds: bounds[1] - bounds[0])
+            for position in range(start, end):
+                found[self._ids[position]] = None
+                if len(found) == limit:
+                    break
+        return list(found)
+
+    def suggest(self, conn, text, limit=SUGGEST_LIMIT):
+        """Books whose words start with every word typed so far, titles starting with the text first"""
+        self.sync(conn)
+        return self.lookup(conn, text, limit)
+
+    def lookup(self, conn, text, limit=SUGGEST_LIMIT):
+        """suggest() without the sync, against the index as it stands"""
+        prefixes = words(text)
+        if not prefixes:
+            return []
+        book_ids = self.candidates(prefixes, max(limit, SUGGEST_SCAN))
+        if not book_ids:
+            return []
+        rows = conn.execute(f'''
+            SELECT id, title, author, code, available FROM books WHERE id IN ({', '.join('?' * len(book_ids))})
+        ''', book_ids).fetchall()
+        typed = normalize(text).strip()
+        matches = []
+        for row in rows:
+            # The index matched one typed word already; any others are checked against the row
+            if len(prefixes) > 1:
+                book_words = words(f'{row[1]} {row[2]} {row[3]}')
+                if not all(any(word.startswith(prefix) for word in book_words) for prefix in prefixes):
+                    continue
+            matches.append((not normalize(row[1]).startswith(typed), row[1], row[0], row))
+        matches.sort(key=lambda match: match[:3])
+        return [dict(zip(('id', 'title', 'author', 'code', 'available'), match[3])) for match in matches[:limit]]
+
+    def warm(self):
+        """Build in the background with a pooled connection; suggest() waits for it if needed"""
+        def run():
+            conn = read_pool.acquire()
+            try:
+                with self._lock:
+                    if not self.built:
+                        self.build(conn)
+            finally:
+                read_pool.release(conn)
+        threading.Thread(target=run, name='suggest-index', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._keys),
+                'builds': self.builds,
+                'generation': self.generation,
+                'last_event': self.last_event,
+            }
+
+suggest_index = PrefixIndex()
@@ -0,0 +1,37 @@
+"""Shared fixtures: every test runs against throwaway libraries.
+
+database.py opens LIBRARY_DB and its -generations counter file when it is
+first imported, so LIBRARY_DB is pointed at a temporary directory here, before
+any test module imports the app. Otherwise a test run would bump the counters
+of a library.db in the working directory and invalidate a live app's caches.
+"""
+import os
+import tempfile
+
+import pytest
+
+DIRECTORY = tempfile.mkdtemp(prefix='library-tests-')
+os.environ['LIBRARY_DB'] = os.path.join(DIRECTORY, 'library.db')
+
+def build_library(path, max_connections=2):
+    """A connection pool on a migrated library at path, seeded with the demo data"""
+    from database import ConnectionPool, seed_db
+    from migrations import migrate
+
+    pool = ConnectionPool(path, max_connections)
+    conn = pool.acquire()
+    try:
+        migrate(conn)
+        seed_db(conn)
+    finally:
+        pool.release(conn)
+    return pool
+
+@pytest.fixture(scope='session')
+def library():
+    """Connection to the seeded library at LIBRARY_DB, shared by read-only tests"""
+    pool = build_library(os.environ['LIBRARY_DB'])
+    conn = pool.acquire()
+    yield conn
+    pool.release(conn)
+    pool.close_all()
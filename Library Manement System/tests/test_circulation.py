@@ -0,0 +1,53 @@
+import os
+import threading
+
+from circulation import issue_book, return_loan
+
+from conftest import build_library
+
+THREADS = 32
+ROUNDS = 5
+
+def race(pool, book_id, threads):
+    """Race `threads` desks to issue one book; returns the transaction ids that won"""
+    barrier = threading.Barrier(threads)
+    winners = []
+    errors = []
+
+    def desk(user_id):
+        conn = pool.acquire()
+        try:
+            barrier.wait()
+            transaction_id = issue_book(conn, book_id, user_id)
+            if transaction_id is not None:
+                winners.append(transaction_id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            pool.release(conn)
+
+    workers = [threading.Thread(target=desk, args=(2 + n % 2,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+    return winners
+
+def test_one_copy_is_issued_exactly_once(tmp_path):
+    pool = build_library(os.path.join(tmp_path, 'circulation.db'), THREADS + 1)
+    conn = pool.acquire()
+    try:
+        book_id = conn.execute('SELECT id FROM books WHERE copies_available = 1 LIMIT 1').fetchone()[0]
+        for _ in range(ROUNDS):
+            winners = race(pool, book_id, THREADS)
+            open_loans = conn.execute(
+                "SELECT COUNT(*) FROM transactions WHERE book_id = ? AND status = 'issued'", (book_id,)
+            ).fetchone()[0]
+            assert len(winners) == 1
+            assert open_loans == 1
+            assert return_loan(conn, winners[0])
+    finally:
+        pool.release(conn)
+        pool.close_all()
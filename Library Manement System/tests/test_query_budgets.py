@@ -0,0 +1,7 @@
+from repository import check_query_budgets
+
+def test_views_stay_within_query_budgets(library):
+    # Each view runs under a QueryCounter, with a cold and then a warm catalogue cache
+    over = [f'{name}: {count} statements (budget {budget})'
+            for name, count, budget in check_query_budgets(library) if count > budget]
+    assert over == [], '\n'.join(over)
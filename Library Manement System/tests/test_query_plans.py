@@ -0,0 +1,6 @@
+from migrations import check_query_plans
+from repository import hot_queries
+
+def test_hot_queries_use_indexes(library):
+    failures = check_query_plans(library, hot_queries(library))
+    assert failures == [], '\n'.join(f'{name}: {problem} ({detail})' for name, detail, problem in failures)